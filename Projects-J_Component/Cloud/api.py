@@ -1,48 +1,219 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from mangum import Mangum
-import random
+from starlette.exceptions import HTTPException
+from pydantic import BaseModel, Field
+from typing import List
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
 
-app = FastAPI(title="E-Commerce API", version="1.0")
+IN_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
 
-# ✅ Add CORS middleware before any routes
+# Interactive docs are off by default on Lambda: nobody browses them there,
+# and serving them would build the OpenAPI schema inside a request
+API_DOCS = os.environ.get("API_DOCS", "false" if IN_LAMBDA else "true").lower() == "true"
+# Send one request through the app during the Lambda init phase, so lazy
+# imports and first-call setup are paid before real traffic arrives
+LAMBDA_PREWARM = os.environ.get("LAMBDA_PREWARM", "true" if IN_LAMBDA else "false").lower() == "true"
+
+DISCOUNTS = [0, 5, 10, 15, 20]
+VENDORS = ["TechWorld", "ShopEase", "ElectroMart", "MegaDeals"]
+
+# Changing the seed reshuffles every offer; offers are otherwise stable
+DISCOUNT_SEED = os.environ.get("DISCOUNT_SEED", "v1")
+DISCOUNT_CACHE_TTL = int(os.environ.get("DISCOUNT_CACHE_TTL", 300))
+DISCOUNT_CACHE_SIZE = int(os.environ.get("DISCOUNT_CACHE_SIZE", 10000))
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 100))
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 64 * 1024))
+
+
+# --- Request / response models ---
+class Product(BaseModel):
+    product_id: int = Field(gt=0)
+    name: str = Field(min_length=1, max_length=200)
+    price: float = Field(gt=0)
+
+
+class BatchRequest(BaseModel):
+    products: List[Product] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+class Offer(BaseModel):
+    product_id: int
+    discount: int
+    vendor: str
+    discounted_price: float
+    message: str
+
+
+class BatchResponse(BaseModel):
+    offers: List[Offer]
+
+
+# --- Offer cache (lives as long as the Lambda container) ---
+class TTLCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+offer_cache = TTLCache(DISCOUNT_CACHE_TTL, DISCOUNT_CACHE_SIZE)
+
+
+def pick_offer(product_id):
+    """Deterministic (discount, vendor) for a product, same on every container"""
+    digest = hashlib.sha256(f"{DISCOUNT_SEED}:{product_id}".encode()).digest()
+    return DISCOUNTS[digest[0] % len(DISCOUNTS)], VENDORS[digest[1] % len(VENDORS)]
+
+
+def price_product(product):
+    key = (product.product_id, product.name, product.price)
+    offer = offer_cache.get(key)
+    if offer is None:
+        discount, vendor = pick_offer(product.product_id)
+        if discount > 0:
+            message = f"{discount}% discount available from {vendor} for {product.name}."
+        else:
+            message = f"No current discounts for {product.name}."
+        offer = Offer(
+            product_id=product.product_id,
+            discount=discount,
+            vendor=vendor,
+            discounted_price=round(product.price * (100 - discount) / 100, 2),
+            message=message,
+        )
+        offer_cache.set(key, offer)
+    return offer
+
+
+# Reject oversized bodies before they are read and parsed. A plain ASGI
+# middleware, which (unlike @app.middleware) needs no extra task per request.
+# A declared Content-Length is checked up front; chunked bodies are counted
+# as they arrive and cut off with a 413 once they pass the limit.
+class BodySizeLimit:
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and (not length.isdigit() or int(length) > self.max_bytes):
+            await self.reject(send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-raises HTTPExceptions from body reading, so
+                    # this becomes the 413 response
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            # Raised outside a route's exception handling
+            if e.status_code != 413 or started:
+                raise
+            await self.reject(send)
+
+    @staticmethod
+    async def reject(send):
+        body = b'{"detail":"Request body too large"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+app = FastAPI(
+    title="E-Commerce API",
+    version="1.1",
+    docs_url="/docs" if API_DOCS else None,
+    redoc_url="/redoc" if API_DOCS else None,
+    openapi_url="/openapi.json" if API_DOCS else None,
+)
+
+app.add_middleware(BodySizeLimit, max_bytes=MAX_BODY_BYTES)
+
+# ✅ Add CORS middleware before any routes (added last, so it runs first)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],   
+    allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+
 # --- API endpoint: E-Commerce ---
 @app.post("/discount_vendor_info")
-async def add_to_cart(request: Request):
-    try:
-        data = await request.json()
-        print("🔍 Received data:", data)
+async def add_to_cart(product: Product):
+    # Expecting { "product_id": 1, "name": "Product Name", "price": 499 }
+    return {"message": price_product(product).message}
 
-        # Expecting { "product_id": 1, "name": "Product Name", "price": 499 }
-        product_id = data.get("product_id")
-        name = data.get("name")
-        price = data.get("price")
 
-        if not all([product_id, name, price]):
-            raise HTTPException(status_code=400, detail="Missing product details")
+@app.post("/discount_vendor_info/batch", response_model=BatchResponse)
+async def discount_vendor_info_batch(batch: BatchRequest):
+    # Expecting { "products": [{ "product_id": 1, "name": "Product Name", "price": 499 }, ...] }
+    return BatchResponse(offers=[price_product(product) for product in batch.products])
 
-        # Simulate discount and vendor
-        discount = random.choice([0, 5, 10, 15, 20])
-        vendor = random.choice(["TechWorld", "ShopEase", "ElectroMart", "MegaDeals"])
 
-        if discount > 0:
-            message = f"{discount}% discount available from {vendor} for {name}."
-        else:
-            message = f"No current discounts for {name}."
+# --- AWS Lambda handler ---
+# Built once per container and reused by every invocation. The app has no
+# startup/shutdown hooks, so skip running the lifespan protocol per event.
+lambda_handler = Mangum(app, lifespan="off")
 
-        return {"message": message}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+def prewarm():
+    body = '{"products":[{"product_id":1,"name":"warmup","price":1}]}'
+    event = {
+        "version": "2.0", "routeKey": "$default", "rawPath": "/discount_vendor_info/batch",
+        "rawQueryString": "", "body": body, "isBase64Encoded": False,
+        "headers": {"content-type": "application/json", "content-length": str(len(body))},
+        "requestContext": {"http": {"method": "POST", "path": "/discount_vendor_info/batch",
+                                    "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1",
+                                    "userAgent": "prewarm"},
+                           "stage": "$default", "requestId": "prewarm"},
+    }
+    lambda_handler(event, None)
 
 
-# --- AWS Lambda handler ---
-lambda_handler = Mangum(app)
\ No newline at end of file
+if LAMBDA_PREWARM:
+    prewarm()
@@ -0,0 +1,109 @@
+"""Measure Lambda-style cold starts of api.py
+
+Each run starts a fresh interpreter, imports api (the Lambda init phase) and
+sends one API Gateway HTTP API event through lambda_handler (the first
+request), the way a newly scaled-out container does.
+
+    python measure_cold_start.py                  # 20 runs, production settings
+    python measure_cold_start.py --runs 50 --docs # with /docs and /openapi.json
+    python measure_cold_start.py --no-prewarm     # without the init-phase warm-up
+    python measure_cold_start.py --importtime     # slowest imports of one run
+
+Prints JSON with p50/p90/p99/max in milliseconds for import, first request
+and their sum.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = r'''
+import json, time
+t0 = time.perf_counter()
+import api
+t1 = time.perf_counter()
+body = json.dumps({"products": [{"product_id": i, "name": "Product %d" % i, "price": 499}
+                                for i in range(1, 31)]})
+event = {
+    "version": "2.0", "routeKey": "$default", "rawPath": "/discount_vendor_info/batch",
+    "rawQueryString": "", "headers": {"content-type": "application/json",
+                                      "content-length": str(len(body))},
+    "requestContext": {"http": {"method": "POST", "path": "/discount_vendor_info/batch",
+                                "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1",
+                                "userAgent": "measure"},
+                       "stage": "$default", "requestId": "measure", "accountId": "0",
+                       "apiId": "local", "domainName": "localhost", "time": "", "timeEpoch": 0},
+    "body": body, "isBase64Encoded": False,
+}
+class Context:
+    function_name = "measure"
+    aws_request_id = "measure"
+response = api.lambda_handler(event, Context())
+t2 = time.perf_counter()
+assert response["statusCode"] == 200, response
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_request_ms": (t2 - t1) * 1000}))
+'''
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summary(values):
+    return {
+        'p50': round(statistics.median(values), 2),
+        'p90': round(percentile(values, 90), 2),
+        'p99': round(percentile(values, 99), 2),
+        'max': round(max(values), 2),
+    }
+
+
+def run_once(env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    result = subprocess.run(command, cwd=HERE, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--docs', action='store_true', help='enable /docs and /openapi.json')
+    parser.add_argument('--no-prewarm', action='store_true', help='skip the warm-up request during import')
+    parser.add_argument('--importtime', action='store_true', help='show the slowest imports of one run')
+    args = parser.parse_args()
+
+    env = dict(os.environ, AWS_LAMBDA_FUNCTION_NAME='measure', API_DOCS='true' if args.docs else 'false',
+               LAMBDA_PREWARM='false' if args.no_prewarm else 'true')
+
+    if args.importtime:
+        _, stderr = run_once(env, importtime=True)
+        rows = []
+        for line in stderr.splitlines():
+            if line.startswith('import time:') and '|' in line and 'self' not in line:
+                _, cumulative, name = line.split('|')
+                rows.append((int(cumulative), name.rstrip()))
+        for cumulative, name in sorted(rows, reverse=True)[:25]:
+            print(f'{cumulative / 1000:8.1f} ms  {name}')
+        return
+
+    samples = [run_once(env)[0] for _ in range(args.runs)]
+    imports = [s['import_ms'] for s in samples]
+    firsts = [s['first_request_ms'] for s in samples]
+    print(json.dumps({
+        'runs': args.runs,
+        'docs': args.docs,
+        'prewarm': not args.no_prewarm,
+        'import_ms': summary(imports),
+        'first_request_ms': summary(firsts),
+        'cold_start_ms': summary([i + f for i, f in zip(imports, firsts)]),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
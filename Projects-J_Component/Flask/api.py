@@ -0,0 +1,327 @@
+"""JSON API for the mobile client, mounted at /api/v1
+
+Menu and restaurant reads carry strong ETags derived from the cache
+namespace versions that the admin routes bump, so polling clients get a 304
+without the server touching the database or serialising anything. Responses
+are gzip (or brotli, if installed) compressed and support `?fields=a,b` to
+trim each record.
+"""
+import gzip
+import hashlib
+import json
+from decimal import Decimal
+from functools import wraps
+
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+from cache import cache, get_active_restaurants, get_restaurant_menu
+from checkout import place_order, CheckoutError
+from models import db, CartItem, MenuItem, Order
+from queries import get_cart_items, add_to_cart_upsert, get_user_orders, get_order_or_404
+from pricing import CartTotals
+from routing import replica_reads
+from search import search_menu
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MIN_COMPRESS_SIZE = 512
+
+
+# Response helpers
+def _json_default(value):
+    # Money columns are Decimal; clients expect plain numbers
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def json_response(payload, status=200, etag=None, cache_control='no-cache'):
+    body = json.dumps(payload, separators=(',', ':'), default=_json_default)
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Cache-Control'] = cache_control
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+def api_error(message, status):
+    return json_response({'error': message}, status, cache_control='no-store')
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return api_error('Authentication required', 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def json_body():
+    # Requiring a JSON content type also keeps cookie-authenticated writes
+    # out of reach of cross-site HTML forms
+    data = request.get_json(silent=True) if request.is_json else None
+    if not isinstance(data, dict):
+        abort(api_error('Expected a JSON object body', 400))
+    return data
+
+
+def requested_fields():
+    fields = request.args.get('fields')
+    return sorted({f.strip() for f in fields.split(',') if f.strip()}) if fields else None
+
+
+def select_fields(records, fields):
+    if not fields:
+        return records
+    return [{key: record[key] for key in fields if key in record} for record in records]
+
+
+def negotiated_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def conditional_json(version_tag, load, shape):
+    """Serve load() through shape(payload, fields) with a strong ETag
+
+    version_tag identifies the data version (None if no shared version is
+    available, in which case the ETag is a hash of the body). The ETag also
+    covers the field selection and content encoding, since each of those
+    yields different bytes.
+    """
+    fields = requested_fields()
+    encoding = negotiated_encoding()
+    suffix = '-'.join(filter(None, [','.join(fields) if fields else None, encoding]))
+
+    if version_tag is not None:
+        etag = f'{version_tag}-{hashlib.sha1(suffix.encode()).hexdigest()[:8]}' if suffix else version_tag
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+        payload = load()
+        if payload is None:
+            abort(api_error('Not found', 404))
+        return json_response(shape(payload, fields), etag=etag)
+
+    payload = load()
+    if payload is None:
+        abort(api_error('Not found', 404))
+    response = json_response(shape(payload, fields))
+    etag = hashlib.sha1(response.get_data() + suffix.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    response.set_etag(etag)
+    return response
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@api.errorhandler(HTTPException)
+def http_error(e):
+    return api_error(e.description, e.code)
+
+
+@api.after_request
+def compress(response):
+    response.vary.add('Accept-Encoding')
+    encoding = negotiated_encoding()
+    if (encoding is None or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=5)
+    else:
+        data = gzip.compress(data, compresslevel=6)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# Serialisers
+def cart_json(cart_items):
+    # Same totals as the web cart and checkout pages
+    totals = CartTotals(cart_items, current_app.config['DELIVERY_FEE'])
+    return {
+        'items': [{
+            'id': item.id,
+            'menu_item_id': item.menu_item_id,
+            'name': item.menu_item.name,
+            'restaurant': item.menu_item.restaurant.name,
+            'price': item.menu_item.price,
+            'quantity': item.quantity,
+            'subtotal': totals.lines[item.id],
+        } for item in cart_items],
+        'subtotal': totals.subtotal,
+        'delivery_fee': totals.delivery_fee,
+        'total': totals.total,
+    }
+
+
+def order_json(order, item_names=False):
+    items = []
+    for item in order.order_items:
+        data = {'menu_item_id': item.menu_item_id, 'quantity': item.quantity, 'price': item.price}
+        if item_names:
+            data['name'] = item.menu_item.name
+        items.append(data)
+    return {
+        'id': order.id,
+        'status': order.status,
+        'total_amount': order.total_amount,
+        'delivery_fee': order.delivery_fee,
+        'total': order.grand_total,
+        'total_items': sum(item.quantity for item in order.order_items),
+        'delivery_address': order.delivery_address,
+        'phone': order.phone,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+        'updated_at': order.updated_at.isoformat() if order.updated_at else None,
+        'items': items,
+    }
+
+
+# Restaurants and menus
+@api.route('/restaurants')
+@replica_reads
+def restaurants():
+    version = cache.shared_version('restaurants')
+    return conditional_json(
+        None if version is None else f'restaurants-{version}',
+        get_active_restaurants,
+        lambda payload, fields: {'restaurants': select_fields(payload, fields)},
+    )
+
+
+@api.route('/restaurants/<int:restaurant_id>/menu')
+@replica_reads
+def restaurant_menu(restaurant_id):
+    version = cache.shared_version('menu:%d' % restaurant_id)
+    return conditional_json(
+        None if version is None else f'menu-{restaurant_id}-{version}',
+        lambda: get_restaurant_menu(restaurant_id),
+        lambda payload, fields: {
+            'restaurant': payload['restaurant'],
+            'categories': payload['categories'],
+            'menu_items': select_fields(payload['menu_items'], fields),
+        },
+    )
+
+
+@api.route('/search')
+@replica_reads
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return api_error('q is required', 400)
+    limit = min(request.args.get('limit', current_app.config['SEARCH_RESULTS_LIMIT'], type=int), 100)
+    found = search_menu(query,
+                        category=request.args.get('category') or None,
+                        restaurant_id=request.args.get('restaurant_id', type=int),
+                        price_bucket=request.args.get('price') or None,
+                        limit=max(limit, 1),
+                        price_buckets=current_app.config['SEARCH_PRICE_BUCKETS'])
+    return json_response({'results': select_fields(found['results'], requested_fields()),
+                          'facets': found['facets']})
+
+
+# Cart
+@api.route('/cart')
+@api_login_required
+def cart():
+    return json_response(cart_json(get_cart_items(current_user.id)), cache_control='private, no-store')
+
+
+@api.route('/cart/items', methods=['POST'])
+@api_login_required
+def add_cart_item():
+    data = json_body()
+    menu_item_id = data.get('menu_item_id')
+    # bool is an int subclass: JSON true must not mean item 1
+    if isinstance(menu_item_id, bool) or not isinstance(menu_item_id, int):
+        return api_error('menu_item_id must be an integer', 400)
+    added = add_to_cart_upsert(current_user.id, menu_item_id)
+    if added is None:
+        if db.session.get(MenuItem, menu_item_id) is None:
+            return api_error('Menu item not found', 404)
+        return api_error('Item is not available', 409)
+    return json_response({'menu_item_id': menu_item_id, 'quantity': added.quantity},
+                         cache_control='no-store')
+
+
+@api.route('/cart/items/<int:cart_item_id>', methods=['PATCH', 'DELETE'])
+@api_login_required
+def update_cart_item(cart_item_id):
+    cart_item = CartItem.query.filter_by(id=cart_item_id, user_id=current_user.id).first()
+    if cart_item is None:
+        return api_error('Cart item not found', 404)
+    if request.method == 'PATCH':
+        quantity = json_body().get('quantity')
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            return api_error('quantity must be an integer', 400)
+    else:
+        quantity = 0
+    if quantity <= 0:
+        db.session.delete(cart_item)
+    else:
+        cart_item.quantity = quantity
+    db.session.commit()
+    return json_response(cart_json(get_cart_items(current_user.id)), cache_control='private, no-store')
+
+
+# Checkout and orders
+@api.route('/checkout', methods=['POST'])
+@api_login_required
+def checkout():
+    data = json_body()
+    if not data.get('delivery_address') or not data.get('phone'):
+        return api_error('delivery_address and phone are required', 400)
+    # Same limits as OrderForm: the column lengths
+    for name in ('delivery_address', 'phone', 'idempotency_key'):
+        value, max_length = data.get(name), Order.__table__.c[name].type.length
+        if value is not None and (not isinstance(value, str) or len(value) > max_length):
+            return api_error(f'{name} must be a string of at most {max_length} characters', 400)
+    try:
+        order, created = place_order(current_user.id, data['delivery_address'], data['phone'],
+                                     data.get('idempotency_key'))
+    except CheckoutError as e:
+        return api_error(str(e), 409)
+    return json_response(order_json(get_order_or_404(order.id), item_names=True),
+                         201 if created else 200, cache_control='no-store')
+
+
+@api.route('/orders')
+@api_login_required
+@replica_reads
+def orders():
+    return json_response({'orders': [order_json(order) for order in get_user_orders(current_user.id)]},
+                         cache_control='private, no-cache')
+
+
+@api.route('/orders/<int:order_id>')
+@api_login_required
+@replica_reads
+def order_detail(order_id):
+    order = get_order_or_404(order_id)
+    if order.user_id != current_user.id and not current_user.is_admin:
+        return api_error('Order not found', 404)
+    return json_response(order_json(order, item_names=True), cache_control='private, no-cache')
@@ -1,16 +1,61 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, Restaurant, MenuItem, CartItem, Order, OrderItem
-from forms import LoginForm, RegisterForm, RestaurantForm, MenuItemForm, OrderForm
+from models import db, User, Restaurant, MenuItem, CartItem, Order, OrderItem, ORDER_STATUSES
+from forms import LoginForm, RegisterForm, RestaurantForm, MenuItemForm, MenuImportForm, OrderForm
 from config import Config
-from datetime import datetime
-import time
+from queries import (get_cart_items, add_to_cart_upsert, get_user_orders, get_order_or_404,
+                     get_recent_orders, get_admin_orders_page, init_query_budget)
+from migrations import setup, init_migrations
+from checkout import place_order, CheckoutError
+from cache import (cache, get_active_restaurants, get_restaurant_menu, invalidate_restaurants,
+                   invalidate_menu, load_user_cached, invalidate_user)
+from sessions import init_sessions
+from passwords import hasher, HashingBusy
+from throttle import login_throttle
+from werkzeug.middleware.proxy_fix import ProxyFix
+from api import api
+from fragments import fragment_cache
+from search import search_menu, init_search
+from rollups import dashboard_metrics, record_status_change, init_rollups
+from events import order_events, order_event_data, user_channel, ADMIN_CHANNEL
+from jobs import jobs
+from tasks import notify_order_status
+from pricing import CartTotals, order_item_counts
+from menu_io import import_menu, read_rows, format_for, export_response, init_menu_io, FORMATS
+from order_export import export_response as export_orders_response, init_order_export
+from monitoring import monitoring
+from routing import replica_router, replica_reads
+from health import health
+from datetime import datetime, timedelta
+import io
+import uuid
 import os
 
 app = Flask(__name__)
 app.config.from_object(Config)
+if app.config['PROXY_FIX_X_FOR']:
+    # Trust X-Forwarded-For from nginx so request.remote_addr is the client IP
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'],
+                            x_proto=app.config['PROXY_FIX_X_FOR'])
 
 db.init_app(app)
+replica_router.init_app(app)
+# First, so request timing covers the other extensions' request hooks
+monitoring.init_app(app)
+cache.init_app(app)
+init_sessions(app)
+hasher.init_app(app)
+login_throttle.init_app(app)
+fragment_cache.init_app(app)
+order_events.init_app(app)
+jobs.init_app(app)
+health.init_app(app)
+app.register_blueprint(api)
+init_query_budget(app)
+init_search(app)
+init_rollups(app)
+init_menu_io(app)
+init_order_export(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -18,24 +63,7 @@ login_manager.login_message = 'Please log in to access this page.'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Health check endpoint
-@app.route('/health')
-def health_check():
-    """Health check endpoint for Docker and load balancers"""
-    try:
-        # Check database connection
-        db.session.execute(db.text('SELECT 1'))
-        db_status = 'healthy'
-    except Exception as e:
-        db_status = f'unhealthy: {str(e)}'
-    
-    return jsonify({
-        'status': 'healthy' if db_status == 'healthy' else 'degraded',
-        'database': db_status,
-        'timestamp': datetime.utcnow().isoformat()
-    }), 200 if db_status == 'healthy' else 503
+    return load_user_cached(int(user_id))
 
 # Seed sample data
 def seed_sample_data():
@@ -137,9 +165,10 @@ def seed_sample_data():
         }
     ]
     
-    # Add restaurants and their menu items
-    for rest_data in restaurants_data:
-        restaurant = Restaurant(
+    # Add the restaurants in one flush, then their menu items through the
+    # bulk importer (which commits and refreshes the search index)
+    db.session.add_all([
+        Restaurant(
             name=rest_data['name'],
             description=rest_data['description'],
             address=rest_data['address'],
@@ -147,66 +176,45 @@ def seed_sample_data():
             image_url=rest_data['image_url'],
             is_active=True
         )
-        db.session.add(restaurant)
-        db.session.flush()  # Get the restaurant ID
-        
-        # Add menu items for this restaurant
-        for item_data in rest_data['menu_items']:
-            menu_item = MenuItem(
-                name=item_data['name'],
-                description=item_data['description'],
-                price=item_data['price'],
-                category=item_data['category'],
-                image_url=item_data['image_url'],
-                restaurant_id=restaurant.id,
-                is_available=True
-            )
-            db.session.add(menu_item)
-        
-        db.session.commit()
+        for rest_data in restaurants_data
+    ])
+    db.session.flush()
+    menu_rows = [dict(item_data, restaurant=rest_data['name'])
+                 for rest_data in restaurants_data for item_data in rest_data['menu_items']]
+    result = import_menu(enumerate(menu_rows, 1))
+    if result.error_count:
+        print(f"Sample menu items skipped: {result.errors}")
     
+    invalidate_restaurants()
     print("Sample data seeded successfully!")
 
-# Initialize database with retry logic for containerized environments
-def init_db():
-    """Initialize database with retry logic for container startup"""
-    max_retries = 30
-    retry_delay = 2
+def seed_database():
+    """Create the admin user and sample data if they are missing"""
+    if not User.query.filter_by(username='admin').first():
+        admin = User(username='admin', email='admin@foodapp.com')
+        admin.set_password('admin123')
+        admin.is_admin = True
+        db.session.add(admin)
+        db.session.commit()
     
-    for attempt in range(max_retries):
-        try:
-            with app.app_context():
-                db.create_all()
-                # Create admin user if it doesn't exist
-                if not User.query.filter_by(username='admin').first():
-                    admin = User(username='admin', email='admin@foodapp.com')
-                    admin.set_password('admin123')
-                    admin.is_admin = True
-                    db.session.add(admin)
-                    db.session.commit()
-                
-                # Seed sample data if database is empty
-                seed_sample_data()
-                
-                print("Database initialized successfully")
-                return True
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"Database initialization attempt {attempt + 1} failed: {e}. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print(f"Failed to initialize database after {max_retries} attempts: {e}")
-                raise
-    return False
-
-# Initialize database on startup
-if os.environ.get('INIT_DB', 'true').lower() == 'true':
-    init_db()
+    # Seed sample data if database is empty
+    seed_sample_data()
+
+# Schema setup and seeding run once per deploy through `flask db init`, never
+# when a worker imports the app
+init_migrations(app, seed=seed_database)
+
+def init_db():
+    """Migrate and seed for the development server (`python app.py`)"""
+    with app.app_context():
+        setup(seed_database)
+    print("Database initialized successfully")
 
 # Home page
 @app.route('/')
+@replica_reads
 def index():
-    restaurants = Restaurant.query.filter_by(is_active=True).all()
+    restaurants = get_active_restaurants()
     return render_template('index.html', restaurants=restaurants)
 
 # Authentication routes
@@ -217,13 +225,32 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user and user.check_password(form.password.data):
+        ip = request.remote_addr
+        username = form.username.data
+        # Reject throttled clients before spending any CPU on hashing
+        if login_throttle.is_blocked(ip, username):
+            flash('Too many failed login attempts. Please try again later.', 'error')
+            return render_template('login.html', form=form), 429
+        
+        user = User.query.filter_by(username=username).first()
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+            if valid and user.password_needs_rehash():
+                # Hash parameters changed since this password was set
+                user.set_password(form.password.data)
+                db.session.commit()
+        except HashingBusy:
+            flash('The server is busy. Please try again in a moment.', 'error')
+            return render_template('login.html', form=form), 503
+        
+        if valid:
+            login_throttle.reset(ip, username)
             login_user(user)
             flash('Login successful!', 'success')
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
+            login_throttle.record_failure(ip, username)
             flash('Invalid username or password', 'error')
     return render_template('login.html', form=form)
 
@@ -240,7 +267,11 @@ def register():
             flash('Email already registered', 'error')
         else:
             user = User(username=form.username.data, email=form.email.data)
-            user.set_password(form.password.data)
+            try:
+                user.set_password(form.password.data)
+            except HashingBusy:
+                flash('The server is busy. Please try again in a moment.', 'error')
+                return render_template('register.html', form=form), 503
             db.session.add(user)
             db.session.commit()
             flash('Registration successful! Please log in.', 'success')
@@ -250,45 +281,65 @@ def register():
 @app.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('You have been logged out', 'info')
     return redirect(url_for('index'))
 
 # Restaurant and menu routes
 @app.route('/restaurant/<int:restaurant_id>')
+@replica_reads
 def restaurant_detail(restaurant_id):
-    restaurant = Restaurant.query.get_or_404(restaurant_id)
-    menu_items = MenuItem.query.filter_by(restaurant_id=restaurant_id, is_available=True).all()
-    categories = db.session.query(MenuItem.category).filter_by(restaurant_id=restaurant_id).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
-    return render_template('restaurant.html', restaurant=restaurant, menu_items=menu_items, categories=categories)
+    menu = get_restaurant_menu(restaurant_id)
+    if menu is None:
+        abort(404)
+    return render_template('restaurant.html', restaurant=menu['restaurant'],
+                           menu_items=menu['menu_items'], categories=menu['categories'])
+
+@app.route('/search')
+@replica_reads
+def search():
+    query = request.args.get('q', '').strip()
+    filters = {
+        'category': request.args.get('category') or None,
+        'restaurant_id': request.args.get('restaurant_id', type=int),
+        'price_bucket': request.args.get('price') or None,
+    }
+    found = search_menu(query, limit=app.config['SEARCH_RESULTS_LIMIT'],
+                        price_buckets=app.config['SEARCH_PRICE_BUCKETS'], **filters)
+    return render_template('search.html', query=query, filters=filters,
+                           results=found['results'], facets=found['facets'])
 
 # Cart routes
 @app.route('/cart')
 @login_required
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.menu_item.price * item.quantity for item in cart_items)
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    cart_items = get_cart_items(current_user.id)
+    totals = CartTotals(cart_items, app.config['DELIVERY_FEE'])
+    return render_template('cart.html', cart_items=cart_items, totals=totals)
 
 @app.route('/add_to_cart/<int:item_id>', methods=['POST'])
 @login_required
 def add_to_cart(item_id):
-    menu_item = MenuItem.query.get_or_404(item_id)
-    if not menu_item.is_available:
+    added = add_to_cart_upsert(current_user.id, item_id)
+    if added is None:
+        # Only the failure path looks the item up again, to tell 404 from unavailable
+        menu_item = db.get_or_404(MenuItem, item_id)
         flash('Item is not available', 'error')
         return redirect(url_for('restaurant_detail', restaurant_id=menu_item.restaurant_id))
-    
-    cart_item = CartItem.query.filter_by(user_id=current_user.id, menu_item_id=item_id).first()
-    if cart_item:
-        cart_item.quantity += 1
-    else:
-        cart_item = CartItem(user_id=current_user.id, menu_item_id=item_id, quantity=1)
-        db.session.add(cart_item)
-    
-    db.session.commit()
-    flash(f'{menu_item.name} added to cart!', 'success')
-    return redirect(url_for('restaurant_detail', restaurant_id=menu_item.restaurant_id))
+    flash(f'{added.name} added to cart!', 'success')
+    return redirect(url_for('restaurant_detail', restaurant_id=added.restaurant_id))
+
+@app.route('/add_to_cart/<int:item_id>.json', methods=['POST'])
+@login_required
+def add_to_cart_json(item_id):
+    """Add-to-cart for API clients: one statement, no redirect or flash"""
+    added = add_to_cart_upsert(current_user.id, item_id)
+    if added is None:
+        if db.session.get(MenuItem, item_id) is None:
+            return jsonify({'error': 'Menu item not found'}), 404
+        return jsonify({'error': 'Item is not available'}), 409
+    return jsonify({'menu_item_id': item_id, 'quantity': added.quantity})
 
 @app.route('/update_cart/<int:cart_item_id>', methods=['POST'])
 @login_required
@@ -323,73 +374,87 @@ def remove_from_cart(cart_item_id):
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    if not cart_items:
-        flash('Your cart is empty', 'error')
-        return redirect(url_for('cart'))
-    
     form = OrderForm()
     if form.validate_on_submit():
-        total = sum(item.menu_item.price * item.quantity for item in cart_items)
-        order = Order(
-            user_id=current_user.id,
-            total_amount=total,
-            delivery_address=form.delivery_address.data,
-            phone=form.phone.data,
-            status='pending'
-        )
-        db.session.add(order)
-        db.session.flush()
-        
-        for cart_item in cart_items:
-            order_item = OrderItem(
-                order_id=order.id,
-                menu_item_id=cart_item.menu_item_id,
-                quantity=cart_item.quantity,
-                price=cart_item.menu_item.price
-            )
-            db.session.add(order_item)
-            db.session.delete(cart_item)
-        
-        db.session.commit()
-        flash('Order placed successfully!', 'success')
+        try:
+            order, created = place_order(current_user.id, form.delivery_address.data,
+                                         form.phone.data, form.idempotency_key.data)
+        except CheckoutError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('cart'))
+        if created:
+            flash('Order placed successfully!', 'success')
         return redirect(url_for('order_history'))
     
-    total = sum(item.menu_item.price * item.quantity for item in cart_items)
-    return render_template('checkout.html', cart_items=cart_items, total=total, form=form)
+    cart_items = get_cart_items(current_user.id)
+    if not cart_items:
+        flash('Your cart is empty', 'error')
+        return redirect(url_for('cart'))
+    
+    # One key per rendered form, so a double submit maps to a single order
+    if not form.idempotency_key.data or form.idempotency_key.errors:
+        form.idempotency_key.data = uuid.uuid4().hex
+    totals = CartTotals(cart_items, app.config['DELIVERY_FEE'])
+    return render_template('checkout.html', cart_items=cart_items, totals=totals, form=form)
 
 @app.route('/orders')
 @login_required
+@replica_reads
 def order_history():
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    # Calculate total items for each order
-    for order in orders:
-        order.total_items = sum(item.quantity for item in order.order_items)
-    return render_template('orders.html', orders=orders)
+    orders = get_user_orders(current_user.id, with_items=False)
+    item_counts = order_item_counts([order.id for order in orders])
+    return render_template('orders.html', orders=orders, item_counts=item_counts)
+
+@app.route('/events/orders')
+@login_required
+def order_event_stream():
+    # Admins follow every order, customers only their own
+    channels = [ADMIN_CHANNEL] if current_user.is_admin else [user_channel(current_user.id)]
+    return order_events.stream(channels, request.headers.get('Last-Event-ID'))
 
 @app.route('/order/<int:order_id>')
 @login_required
+@replica_reads
 def order_detail(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = get_order_or_404(order_id)
     if order.user_id != current_user.id and not current_user.is_admin:
         flash('Unauthorized', 'error')
         return redirect(url_for('index'))
     return render_template('order_detail.html', order=order)
 
+def parse_date(value):
+    """Parse a YYYY-MM-DD query parameter, ignoring malformed input"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def admin_order_filters():
+    return {
+        'status': request.args.get('status') if request.args.get('status') in ORDER_STATUSES else None,
+        'restaurant_id': request.args.get('restaurant_id', type=int),
+        'date_from': request.args.get('date_from') or None,
+        'date_to': request.args.get('date_to') or None,
+    }
+
 # Admin routes
 @app.route('/admin')
 @login_required
+@replica_reads
 def admin_dashboard():
     if not current_user.is_admin:
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
     restaurants = Restaurant.query.all()
-    orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
-    return render_template('admin/dashboard.html', restaurants=restaurants, orders=orders)
+    orders = get_recent_orders(10)
+    metrics = dashboard_metrics(app.config['DASHBOARD_DAYS'])
+    return render_template('admin/dashboard.html', restaurants=restaurants, orders=orders,
+                           metrics=metrics, restaurant_names={r.id: r.name for r in restaurants})
 
 @app.route('/admin/restaurants')
 @login_required
+@replica_reads
 def admin_restaurants():
     if not current_user.is_admin:
         flash('Access denied', 'error')
@@ -416,12 +481,14 @@ def admin_add_restaurant():
         )
         db.session.add(restaurant)
         db.session.commit()
+        invalidate_restaurants()
         flash('Restaurant added successfully!', 'success')
         return redirect(url_for('admin_restaurants'))
     return render_template('admin/add_restaurant.html', form=form)
 
 @app.route('/admin/restaurant/<int:restaurant_id>/menu')
 @login_required
+@replica_reads
 def admin_restaurant_menu(restaurant_id):
     if not current_user.is_admin:
         flash('Access denied', 'error')
@@ -452,19 +519,95 @@ def admin_add_menu_item():
         )
         db.session.add(menu_item)
         db.session.commit()
+        invalidate_menu(menu_item.restaurant_id)
         flash('Menu item added successfully!', 'success')
         return redirect(url_for('admin_restaurant_menu', restaurant_id=form.restaurant_id.data))
     return render_template('admin/add_menu_item.html', form=form)
 
+@app.route('/admin/menu/import', methods=['GET', 'POST'])
+@login_required
+def admin_import_menu():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    form = MenuImportForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        fmt = form.format.data or format_for(upload.filename)
+        # Read the upload as a stream; large files are spooled to disk by Werkzeug
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            result = import_menu(read_rows(stream, fmt), dry_run=form.dry_run.data)
+        except UnicodeDecodeError:
+            flash('The file is not UTF-8 encoded', 'error')
+        else:
+            flash(('Dry run: ' if form.dry_run.data else 'Import finished: ') + result.summary(),
+                  'error' if result.error_count else 'success')
+    return render_template('admin/import_menu.html', form=form, result=result)
+
+@app.route('/admin/menu/export')
+@login_required
+def admin_export_menu():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    return export_response(fmt, request.args.get('restaurant_id', type=int))
+
+@app.route('/admin/cache-stats')
+@login_required
+def admin_cache_stats():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    return jsonify({'fragments': fragment_cache.stats()})
+
 @app.route('/admin/orders')
 @login_required
+@replica_reads
 def admin_orders():
     if not current_user.is_admin:
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    # Filters are echoed back into the form, the "next page" and export links
+    filters = admin_order_filters()
+    date_from = parse_date(filters['date_from'])
+    date_to = parse_date(filters['date_to'])
+    orders, next_cursor = get_admin_orders_page(
+        cursor=request.args.get('cursor'),
+        page_size=app.config['ADMIN_ORDERS_PAGE_SIZE'],
+        status=filters['status'],
+        restaurant_id=filters['restaurant_id'],
+        date_from=date_from,
+        date_to=date_to + timedelta(days=1) if date_to else None,
+    )
+    restaurants = db.session.query(Restaurant.id, Restaurant.name).order_by(Restaurant.name).all()
+    filters = {key: value for key, value in filters.items() if value}
+    return render_template('admin/orders.html', orders=orders, next_cursor=next_cursor,
+                           filters=filters, statuses=ORDER_STATUSES, restaurants=restaurants,
+                           is_first_page=not request.args.get('cursor'))
+
+@app.route('/admin/orders/export')
+@login_required
+def admin_export_orders():
+    if not current_user.is_admin:
+        flash('Access denied', 'error')
+        return redirect(url_for('index'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    filters = admin_order_filters()
+    return export_orders_response(fmt, status=filters['status'], restaurant_id=filters['restaurant_id'],
+                                  date_from=parse_date(filters['date_from']),
+                                  date_to=parse_date(filters['date_to']))
 
 @app.route('/admin/order/<int:order_id>/update_status', methods=['POST'])
 @login_required
@@ -473,12 +616,19 @@ def admin_update_order_status(order_id):
         flash('Access denied', 'error')
         return redirect(url_for('index'))
     
-    order = Order.query.get_or_404(order_id)
+    # Lock the order so concurrent updates move it between rollup buckets in turn
+    order = db.first_or_404(db.select(Order).filter_by(id=order_id).with_for_update())
     new_status = request.form.get('status')
-    if new_status in ['pending', 'confirmed', 'preparing', 'out_for_delivery', 'delivered', 'cancelled']:
+    if new_status in ORDER_STATUSES:
+        old_status = order.status
         order.status = new_status
         order.updated_at = datetime.utcnow()
+        record_status_change(order, old_status)
+        event = order_event_data(order)
         db.session.commit()
+        order_events.publish_order('order_status', event)
+        if new_status != old_status:
+            notify_order_status.delay(event['order_id'], new_status)
         flash('Order status updated!', 'success')
     return redirect(url_for('admin_orders'))
 
@@ -487,5 +637,7 @@ if __name__ == '__main__':
     host = os.environ.get('FLASK_HOST', '0.0.0.0')
     port = int(os.environ.get('FLASK_PORT', 5000))
     debug = app.config.get('FLASK_DEBUG', False)
+    if os.environ.get('INIT_DB', 'true').lower() == 'true':
+        init_db()
     app.run(host=host, port=port, debug=debug)
 
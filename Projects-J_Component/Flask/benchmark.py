@@ -0,0 +1,503 @@
+"""Load test and benchmark for the main food-ordering flows
+
+Seeds a synthetic dataset, then replays browse-to-checkout sessions through
+the WSGI app with N concurrent clients and reports throughput, p50/p95/p99
+latency and SQL statements per endpoint as JSON.
+
+    python benchmark.py seed --restaurants 50 --items 40 --users 200 --orders 20000
+    python benchmark.py run --clients 16 --duration 30 --output results.json
+    python benchmark.py compare baseline.json results.json --threshold 10
+
+The database is --database, else BENCHMARK_DATABASE_URL, else a local
+SQLite file (benchmark.db), so a run never writes into the development
+database by accident. Seed into an empty database: the dataset is added
+next to the sample data, not merged with an earlier seed.
+
+Each customer client logs in as its own user and loops: home page,
+restaurant page, add one to three items, cart, checkout form, place the
+order, order history. Admin clients (--admin-clients) page through the
+order list with random filters and open the dashboard. By default requests
+go through app.test_client(), so the numbers cover the Flask app and the
+database, not a web server or network. With --url the same sessions are sent
+over HTTP to a running server instead (start it against the same database,
+with QUERY_BUDGET set for SQL counts), and --server-pid adds the server's CPU
+time, as requests per CPU-second, to compare serving modes per core:
+
+    QUERY_BUDGET=1000000 DATABASE_URL=sqlite:///$PWD/benchmark.db \
+        gunicorn --workers 4 --pid server.pid app:app &
+    python benchmark.py run --url http://127.0.0.1:8000 --server-pid $(cat server.pid)
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'benchmark'
+USER_PREFIX = 'bench_user_'
+RESTAURANT_PREFIX = 'Bench Restaurant '
+CATEGORIES = ['Pizza', 'Burgers', 'Sides', 'Drinks', 'Desserts', 'Salads', 'Noodles', 'Soups']
+STATUSES = ['pending', 'confirmed', 'preparing', 'out_for_delivery', 'delivered', 'delivered',
+            'delivered', 'cancelled']
+BATCH = 5000
+
+
+def load_app(database):
+    """Import the app against the benchmark database"""
+    from sqlalchemy.engine import make_url
+
+    url = make_url(database)
+    if (url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+            and not os.path.isabs(url.database)):
+        # Flask-SQLAlchemy would resolve it inside the instance folder instead
+        url = url.set(database=os.path.abspath(url.database))
+    database = url.render_as_string(hide_password=False)
+    os.environ['DATABASE_URL'] = database
+    # config.py prefers DB_HOST (set in every compose service) over
+    # DATABASE_URL, and replicas would serve reads from the live data
+    for name in ('DB_HOST', 'DATABASE_REPLICA_URLS'):
+        os.environ.pop(name, None)
+    sys.path.insert(0, HERE)
+    from app import app
+    from models import db
+    with app.app_context():
+        actual = db.engine.url
+    if actual.render_as_string(hide_password=False) != database:
+        sys.exit(f'The app connected to {actual!r} instead of {url!r}; refusing to continue')
+    app.config.update(
+        WTF_CSRF_ENABLED=False,
+        # Count SQL statements per request (reported in X-Query-Count)
+        QUERY_BUDGET=10 ** 9,
+        QUERY_BUDGET_ASSERT=False,
+    )
+    return app
+
+
+# Seeding
+def _batches(rows):
+    rows = iter(rows)
+    while True:
+        batch = [row for _, row in zip(range(BATCH), rows)]
+        if not batch:
+            return
+        yield batch
+
+
+def seed(args):
+    app = load_app(args.database)
+    from sqlalchemy import func, insert, select
+    from app import seed_database
+    from migrations import setup
+    from models import db, MenuItem, Order, OrderItem, Restaurant, User
+    from passwords import hasher
+    import rollups
+    import search
+
+    rnd = random.Random(args.seed)
+    with app.app_context():
+        setup(seed_database)
+        if db.session.scalar(select(func.count()).where(User.username.like(USER_PREFIX + '%'))):
+            sys.exit('This database already holds a benchmark dataset; seed an empty one')
+        started = time.perf_counter()
+        now = datetime.utcnow()
+
+        db.session.execute(insert(Restaurant), [
+            {'name': f'{RESTAURANT_PREFIX}{n}', 'description': f'Synthetic restaurant {n}',
+             'address': f'{n} Benchmark Street', 'phone': '+1 (555) 000-0000', 'is_active': True,
+             'created_at': now}
+            for n in range(args.restaurants)])
+        restaurant_ids = db.session.scalars(
+            select(Restaurant.id).where(Restaurant.name.like(RESTAURANT_PREFIX + '%'))).all()
+
+        for batch in _batches(
+                {'name': f'Item {n}', 'description': f'Synthetic menu item {n} of restaurant {rid}',
+                 'price': round(rnd.uniform(2, 40), 2), 'category': rnd.choice(CATEGORIES),
+                 'is_available': rnd.random() > 0.05, 'restaurant_id': rid, 'created_at': now}
+                for rid in restaurant_ids for n in range(args.items)):
+            db.session.execute(insert(MenuItem), batch)
+        items = db.session.execute(
+            select(MenuItem.id, MenuItem.price).where(MenuItem.restaurant_id.in_(restaurant_ids))).all()
+
+        # One hash for every user: hashing is deliberately slow
+        password_hash = hasher.hash(PASSWORD)
+        db.session.execute(insert(User), [
+            {'username': f'{USER_PREFIX}{n}', 'email': f'{USER_PREFIX}{n}@bench.local',
+             'password_hash': password_hash, 'is_admin': False, 'created_at': now}
+            for n in range(args.users)])
+        user_ids = db.session.scalars(select(User.id).where(User.username.like(USER_PREFIX + '%'))).all()
+
+        # Historical orders get explicit ids so their items can be written in bulk
+        next_id = (db.session.scalar(select(func.max(Order.id))) or 0) + 1
+        for start in range(0, args.orders, BATCH):
+            orders, lines = [], []
+            for order_id in range(next_id + start, next_id + min(start + BATCH, args.orders)):
+                picked = rnd.sample(items, rnd.randint(1, 4))
+                quantities = [rnd.randint(1, 3) for _ in picked]
+                created = now - timedelta(days=args.days * rnd.random())
+                orders.append({'id': order_id, 'user_id': rnd.choice(user_ids),
+                               'total_amount': sum(item.price * q for item, q in zip(picked, quantities)),
+                               'status': rnd.choice(STATUSES), 'delivery_address': '1 Benchmark Street',
+                               'phone': '+1 (555) 000-0000', 'created_at': created, 'updated_at': created})
+                lines.extend({'order_id': order_id, 'menu_item_id': item.id, 'quantity': q,
+                              'price': item.price} for item, q in zip(picked, quantities))
+            db.session.execute(insert(Order), orders)
+            db.session.execute(insert(OrderItem), lines)
+
+        conn = db.session.connection()
+        if conn.dialect.name == 'postgresql':
+            conn.exec_driver_sql("SELECT setval(pg_get_serial_sequence('\"order\"', 'id'), "
+                                 "(SELECT MAX(id) FROM \"order\"))")
+        # Bulk inserts bypass the search and rollup hooks
+        search.rebuild(conn)
+        rollups.rebuild(conn)
+        db.session.commit()
+        return {'restaurants': len(restaurant_ids), 'menu_items': len(items),
+                'users': len(user_ids), 'orders': args.orders,
+                'seconds': round(time.perf_counter() - started, 2)}
+
+
+# Running
+class HttpResponse:
+    def __init__(self, response, body):
+        self.status_code = response.status
+        self.headers = response.headers
+        self.body = body
+
+    def get_data(self, as_text=False):
+        return self.body.decode() if as_text else self.body
+
+
+class HttpClient:
+    """Keep-alive HTTP client with the parts of the test client interface used here"""
+
+    def __init__(self, base_url):
+        url = urlsplit(base_url)
+        self.host, self.port, self.prefix = url.hostname, url.port or 80, url.path.rstrip('/')
+        self.cookies = {}
+        self._conn = None
+
+    def open(self, path, method='GET', data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self._conn.request(method, self.prefix + path, body, headers)
+                response = self._conn.getresponse()
+                body_bytes = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection; retry once on a new one
+                self._conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            if value and 'max-age=0' not in cookie.lower():
+                self.cookies[name.strip()] = value
+            else:
+                self.cookies.pop(name.strip(), None)
+        return HttpResponse(response, body_bytes)
+
+
+def cpu_seconds(pid):
+    """CPU time used so far by a process and all its descendants (Linux /proc)"""
+    children, times = {}, {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        times[int(entry)] = int(fields[11]) + int(fields[12])
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += times.get(current, 0)
+        pending.extend(children.get(current, []))
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def request(self, client, name, method, url, data=None):
+        if method == 'POST':
+            data = dict(data or {}, csrf_token=getattr(client, 'csrf_token', ''))
+        started = time.perf_counter()
+        try:
+            response = client.open(url, method=method, data=data)
+            error = response.status_code >= 400
+        except Exception as e:
+            print(f'{name}: {e!r}', file=sys.stderr)
+            response, error = None, True
+        elapsed = (time.perf_counter() - started) * 1000
+        if self.recording:
+            sql = int(response.headers.get('X-Query-Count', 0)) if response is not None else 0
+            with self._lock:
+                self.samples.setdefault(name, []).append((elapsed, sql))
+                if error:
+                    self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+
+def _login(client, recorder, username, password=PASSWORD):
+    # One CSRF token per session serves every form (ignored when CSRF is off)
+    form = recorder.request(client, 'login_form', 'GET', '/login')
+    match = form is not None and re.search(r'name="csrf_token" type="hidden" value="([^"]+)"',
+                                           form.get_data(as_text=True))
+    client.csrf_token = match.group(1) if match else ''
+    response = recorder.request(client, 'login', 'POST', '/login',
+                                data={'username': username, 'password': password})
+    if response is None or response.status_code != 302:
+        raise RuntimeError(f'Could not log in as {username}')
+
+
+def customer_session(client, recorder, rnd, menus):
+    restaurant_id = rnd.choice(list(menus))
+    recorder.request(client, 'index', 'GET', '/')
+    recorder.request(client, 'restaurant_detail', 'GET', f'/restaurant/{restaurant_id}')
+    for item_id in rnd.sample(menus[restaurant_id], min(len(menus[restaurant_id]), rnd.randint(1, 3))):
+        recorder.request(client, 'add_to_cart', 'POST', f'/add_to_cart/{item_id}')
+    recorder.request(client, 'cart', 'GET', '/cart')
+    response = recorder.request(client, 'checkout_form', 'GET', '/checkout')
+    match = response is not None and re.search(
+        r'name="idempotency_key" type="hidden" value="(\w+)"', response.get_data(as_text=True))
+    recorder.request(client, 'checkout', 'POST', '/checkout', data={
+        'delivery_address': '1 Benchmark Street', 'phone': '+1 (555) 000-0000',
+        'idempotency_key': match.group(1) if match else ''})
+    recorder.request(client, 'order_history', 'GET', '/orders')
+
+
+def admin_session(client, recorder, rnd, restaurant_ids):
+    params = {}
+    if rnd.random() < 0.5:
+        params['status'] = rnd.choice(STATUSES)
+    if rnd.random() < 0.3:
+        params['restaurant_id'] = rnd.choice(restaurant_ids)
+    query = '&'.join(f'{k}={v}' for k, v in params.items())
+    response = recorder.request(client, 'admin_orders', 'GET', '/admin/orders?' + query)
+    match = response is not None and re.search(r'cursor=([\w-]+)', response.get_data(as_text=True))
+    if match:
+        recorder.request(client, 'admin_orders', 'GET', f'/admin/orders?{query}&cursor={match.group(1)}')
+    recorder.request(client, 'admin_dashboard', 'GET', '/admin')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarise(recorder, duration):
+    endpoints = {}
+    for name, samples in sorted(recorder.samples.items()):
+        latencies = [ms for ms, _ in samples]
+        queries = [sql for _, sql in samples]
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(name, 0),
+            'throughput_rps': round(len(samples) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(max(latencies), 2),
+            'sql_mean': round(sum(queries) / len(queries), 2),
+            'sql_max': max(queries),
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return endpoints, {'requests': total, 'errors': sum(e['errors'] for e in endpoints.values()),
+                       'throughput_rps': round(total / duration, 2)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    app = load_app(args.database)
+    from sqlalchemy import select
+    from models import db, MenuItem, User
+
+    with app.app_context():
+        usernames = db.session.scalars(select(User.username)
+                                       .where(User.username.like(USER_PREFIX + '%'))
+                                       .order_by(User.id).limit(args.clients)).all()
+        menus = {}
+        for restaurant_id, item_id in db.session.execute(
+                select(MenuItem.restaurant_id, MenuItem.id).where(MenuItem.is_available == True)):
+            menus.setdefault(restaurant_id, []).append(item_id)
+        dialect = db.engine.dialect.name
+    if len(usernames) < args.clients:
+        sys.exit(f'Need {args.clients} benchmark users, found {len(usernames)}; run `seed` first')
+
+    recorder = Recorder()
+
+    def new_client():
+        return HttpClient(args.url) if args.url else app.test_client()
+
+    clients = [(new_client(), username, False) for username in usernames]
+    clients += [(new_client(), 'admin', True) for _ in range(args.admin_clients)]
+    admin_password = os.environ.get('BENCHMARK_ADMIN_PASSWORD', 'admin123')
+    for client, username, is_admin in clients:
+        _login(client, recorder, username, admin_password if is_admin else PASSWORD)
+
+    stop = threading.Event()
+
+    def worker(number, client, is_admin):
+        rnd = random.Random(args.seed + number)
+        while not stop.is_set():
+            if is_admin:
+                admin_session(client, recorder, rnd, list(menus))
+            else:
+                customer_session(client, recorder, rnd, menus)
+
+    threads = [threading.Thread(target=worker, args=(n, client, is_admin), daemon=True)
+               for n, (client, _, is_admin) in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recorder.recording = True
+    started = time.perf_counter()
+    cpu_started = cpu_seconds(args.server_pid) if args.server_pid else None
+    time.sleep(args.duration)
+    recorder.recording = False
+    duration = time.perf_counter() - started
+    cpu_used = cpu_seconds(args.server_pid) - cpu_started if args.server_pid else None
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    endpoints, total = summarise(recorder, duration)
+    if cpu_used:
+        total['server_cpu_seconds'] = round(cpu_used, 2)
+        total['requests_per_cpu_second'] = round(total['requests'] / cpu_used, 2)
+    result = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'database': dialect,
+            'target': args.url or 'in-process',
+            'clients': args.clients,
+            'admin_clients': args.admin_clients,
+            'duration_s': round(duration, 2),
+            'warmup_s': args.warmup,
+            'seed': args.seed,
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+    return result
+
+
+# Comparing
+def compare(args):
+    """Print per-endpoint changes; exit 1 if any p95 grew by more than --threshold percent
+    or any endpoint now runs more SQL statements per request"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = []
+    print(f"{'endpoint':<20}{'p95 ms':>20}{'change':>10}{'sql/request':>16}{'rps':>18}")
+    for name, now in current['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            print(f'{name:<20}  (new)')
+            continue
+        change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        print(f"{name:<20}{before['p95_ms']:>9.1f} -> {now['p95_ms']:<8.1f}{change:>+9.1f}%"
+              f"{before['sql_mean']:>7.1f} -> {now['sql_mean']:<6.1f}"
+              f"{before['throughput_rps']:>7.1f} -> {now['throughput_rps']:<7.1f}")
+        if change > args.threshold:
+            regressions.append(f'{name}: p95 {change:+.1f}%')
+        if now['sql_mean'] > before['sql_mean'] + 0.5:
+            regressions.append(f"{name}: {before['sql_mean']} -> {now['sql_mean']} SQL statements per request")
+    before, now = baseline['total'], current['total']
+    print(f"\n{'total rps':<20}{before['throughput_rps']:>9.1f} -> {now['throughput_rps']:.1f}")
+    if before.get('requests_per_cpu_second') and now.get('requests_per_cpu_second'):
+        print(f"{'requests/CPU-second':<20}{before['requests_per_cpu_second']:>9.1f} -> "
+              f"{now['requests_per_cpu_second']:.1f}")
+    if regressions:
+        print('\nRegressions:\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.environ.get('BENCHMARK_DATABASE_URL',
+                                                             'sqlite:///' + os.path.join(HERE, 'benchmark.db')))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='create a synthetic dataset')
+    seed_parser.add_argument('--restaurants', type=int, default=50)
+    seed_parser.add_argument('--items', type=int, default=40, help='menu items per restaurant')
+    seed_parser.add_argument('--users', type=int, default=200)
+    seed_parser.add_argument('--orders', type=int, default=20000, help='historical orders')
+    seed_parser.add_argument('--days', type=int, default=90, help='spread historical orders over this many days')
+    seed_parser.add_argument('--seed', type=int, default=1)
+
+    run_parser = commands.add_parser('run', help='replay sessions with concurrent clients')
+    run_parser.add_argument('--clients', type=int, default=8, help='concurrent customer clients')
+    run_parser.add_argument('--admin-clients', type=int, default=1)
+    run_parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    run_parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds first')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help='also write the JSON result here')
+    run_parser.add_argument('--url', help='send requests to this running server instead of in-process')
+    run_parser.add_argument('--server-pid', type=int,
+                            help="with --url: measure this process tree's CPU time (e.g. the gunicorn master)")
+
+    compare_parser = commands.add_parser('compare', help='compare two run results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10, help='allowed p95 growth, percent')
+
+    args = parser.parse_args()
+    command = {'seed': seed, 'run': run, 'compare': compare}[args.command]
+    if args.command == 'compare':
+        command(args)
+        return
+    # The app logs with print(); keep stdout for the JSON result
+    stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        result = command(args)
+    print(json.dumps(result, indent=2), file=stdout)
+
+
+if __name__ == '__main__':
+    main()
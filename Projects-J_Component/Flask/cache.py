@@ -0,0 +1,399 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, User, Restaurant, MenuItem
+from monitoring import monitoring
+from routing import primary
+
+try:
+    import redis
+except ImportError:  # redis is optional, see requirements-prod.txt
+    redis = None
+
+
+class LocalCache:
+    """Thread-safe in-process LRU cache with per-key expiry"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def incr(self, key, ttl=None):
+        with self._lock:
+            value, expires_at = self._data.get(key, (0, None))
+            if expires_at is not None and expires_at < time.monotonic():
+                value, expires_at = 0, None
+            if expires_at is None and ttl:
+                expires_at = time.monotonic() + ttl
+            value = int(value) + 1
+            self._data[key] = (value, expires_at)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Cache:
+    """Read-through cache backed by Redis with an in-process fallback
+
+    Keys are versioned per namespace: bumping a namespace version makes every
+    key written under the old version unreachable, so invalidation is a single
+    INCR instead of a key scan. When Redis is not installed or not reachable
+    the local cache is used; its TTL is kept short because other workers
+    cannot see local invalidations.
+    """
+
+    def __init__(self, app=None):
+        self.local = LocalCache()
+        self.prefix = 'foodapp'
+        self.default_ttl = 300
+        self.local_ttl = 30
+        self.retry_interval = 30
+        self.enabled = True
+        self._redis = None
+        self._redis_down_until = 0.0
+        # Version keys whose bump could not reach Redis, replayed on reconnect
+        self._pending_bumps = set()
+        self._pending_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.prefix = app.config.get('CACHE_KEY_PREFIX', self.prefix)
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', self.default_ttl)
+        self.local_ttl = app.config.get('CACHE_LOCAL_TTL', self.local_ttl)
+        self.retry_interval = app.config.get('CACHE_REDIS_RETRY_INTERVAL', self.retry_interval)
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.local.max_entries = app.config.get('CACHE_LOCAL_MAX_ENTRIES', self.local.max_entries)
+        if redis is not None and app.config.get('CACHE_USE_REDIS', True):
+            self._redis = redis.Redis(
+                host=app.config.get('REDIS_HOST', 'localhost'),
+                port=app.config.get('REDIS_PORT', 6379),
+                db=app.config.get('REDIS_DB', 0),
+                password=app.config.get('REDIS_PASSWORD'),
+                socket_timeout=app.config.get('CACHE_REDIS_TIMEOUT', 0.2),
+                socket_connect_timeout=app.config.get('CACHE_REDIS_TIMEOUT', 0.2),
+            )
+        app.extensions['cache'] = self
+
+    @property
+    def redis(self):
+        """Redis client, or None while Redis is unavailable"""
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        if self._pending_bumps and not self._replay_bumps():
+            return None
+        return self._redis
+
+    def _replay_bumps(self):
+        """Apply the bumps missed while Redis was down; False if it still is
+
+        Until then Redis may hold entries that those writes made stale.
+        """
+        with self._pending_lock:
+            keys, self._pending_bumps = self._pending_bumps, set()
+        try:
+            for key in keys:
+                self._redis_bump(self._redis, key)
+        except redis.RedisError as e:
+            with self._pending_lock:
+                self._pending_bumps |= keys
+            self.redis_failed(e)
+            return False
+        return True
+
+    def redis_failed(self, error):
+        if self._redis_down_until < time.monotonic():
+            print(f"Redis cache unavailable, using in-process cache: {error}")
+        self._redis_down_until = time.monotonic() + self.retry_interval
+
+    def ping(self):
+        """Ping Redis even while it is marked down; None if Redis is not configured"""
+        if self._redis is None:
+            return None
+        return self._redis.ping()
+
+    def key(self, *parts):
+        return ':'.join([self.prefix] + [str(p) for p in parts])
+
+    def _redis_version(self, client, key):
+        """Version stored at key, or the shared epoch if the namespace was never bumped
+
+        Reads never create per-namespace keys, so looking up ids that do not
+        exist cannot grow Redis; only bump() writes them.
+        """
+        value, epoch = client.mget([key, self.key('version-epoch')])
+        if value is not None:
+            return int(value)
+        if epoch is None:
+            epoch = self._redis_epoch(client)
+        return int(epoch)
+
+    def _redis_epoch(self, client):
+        # A timestamp rather than 0, so that after eviction or a Redis restart
+        # versions start above every version number used before
+        epoch_key = self.key('version-epoch')
+        client.set(epoch_key, int(time.time() * 1000), nx=True)
+        return int(client.get(epoch_key))
+
+    def version(self, namespace):
+        """Current version number of a cache namespace"""
+        key = self.key('version', namespace)
+        client = self.redis
+        if client is not None:
+            try:
+                return self._redis_version(client, key)
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        return self.local.get(key) or 0
+
+    def shared_version(self, namespace):
+        """Namespace version as seen by every worker, or None without Redis
+
+        Local fallback versions differ between workers, so they must not be
+        used where a stale answer has no TTL to bound it (e.g. ETags).
+        """
+        client = self.redis
+        if client is None:
+            return None
+        try:
+            return self._redis_version(client, self.key('version', namespace))
+        except redis.RedisError as e:
+            self.redis_failed(e)
+            return None
+
+    def bump(self, namespace):
+        """Invalidate every key in a namespace by moving to a new version"""
+        key = self.key('version', namespace)
+        # Always bump locally too, so this worker never serves stale data
+        # from the fallback cache after Redis comes back or goes away
+        self.local.incr(key)
+        if self._redis is None:
+            return
+        client = self.redis
+        if client is not None:
+            try:
+                self._redis_bump(client, key)
+                return
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        with self._pending_lock:
+            self._pending_bumps.add(key)
+
+    def _redis_bump(self, client, key):
+        # A namespace never bumped reads as the epoch, so start it there
+        epoch = self._redis_epoch(client)
+        pipe = client.pipeline()
+        pipe.set(key, epoch, nx=True)
+        pipe.incr(key)
+        pipe.execute()
+
+    def versioned_key(self, namespace, *parts):
+        return self.key(namespace, 'v%d' % self.version(namespace), *parts)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        client = self.redis
+        if client is not None:
+            try:
+                raw = client.get(key)
+                return json.loads(raw) if raw is not None else None
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        return self.local.get(key)
+
+    def set(self, key, value, ttl=None, local=True):
+        """Store a JSON-serialisable value
+
+        Pass local=False for data that must not go stale in other workers
+        (e.g. permissions): it is then only cached while Redis is up.
+        """
+        if not self.enabled:
+            return
+        ttl = ttl or self.default_ttl
+        client = self.redis
+        if client is not None:
+            try:
+                client.set(key, json.dumps(value), ex=ttl)
+                return
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        if local:
+            self.local.set(key, value, min(ttl, self.local_ttl))
+
+    def incr(self, key, ttl):
+        """Increment a counter that expires ttl seconds after its first hit"""
+        client = self.redis
+        if client is not None:
+            try:
+                pipe = client.pipeline()
+                pipe.incr(key)
+                pipe.expire(key, ttl, nx=True)
+                return pipe.execute()[0]
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        return self.local.incr(key, ttl)
+
+    def get_many(self, keys):
+        """Raw values for several keys in one round trip"""
+        client = self.redis
+        if client is not None:
+            try:
+                return client.mget(keys)
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        return [self.local.get(key) for key in keys]
+
+    def delete(self, key):
+        self.local.delete(key)
+        client = self.redis
+        if client is not None:
+            try:
+                client.delete(key)
+            except redis.RedisError as e:
+                self.redis_failed(e)
+
+    def get_or_set(self, namespace, *parts, loader, ttl=None):
+        """Return the cached value, calling loader() to fill it on a miss
+
+        The key is resolved before loading, so a bump() that races with the
+        load leaves the freshly loaded value under the old, unreachable
+        version. loader may return None for "nothing to cache" (e.g. a
+        missing row); that result is passed through without being stored.
+        """
+        key = self.versioned_key(namespace, *parts)
+        value = self.get(key)
+        # Label by namespace kind ('menu', not 'menu:3') to keep the series count fixed
+        monitoring.cache_result('data', namespace.split(':')[0], value is not None)
+        if value is None:
+            # Never cache what a lagging replica returns
+            with primary():
+                value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+
+cache = Cache()
+
+
+# Cached restaurant and menu reads
+def get_active_restaurants():
+    """Active restaurants for the home page, as plain dicts"""
+    def load():
+        restaurants = Restaurant.query.filter_by(is_active=True).all()
+        return [r.to_dict() for r in restaurants]
+
+    return cache.get_or_set('restaurants', 'active', loader=load)
+
+
+def get_restaurant_menu(restaurant_id):
+    """Restaurant, available menu items and categories, or None if missing"""
+    def load():
+        restaurant = db.session.get(Restaurant, restaurant_id)
+        if restaurant is None:
+            return None
+        menu_items = MenuItem.query.filter_by(restaurant_id=restaurant_id, is_available=True).all()
+        categories = db.session.query(MenuItem.category).filter_by(restaurant_id=restaurant_id).distinct().all()
+        return {
+            'restaurant': restaurant.to_dict(),
+            'menu_items': [item.to_dict() for item in menu_items],
+            'categories': [cat[0] for cat in categories if cat[0]],
+        }
+
+    return cache.get_or_set('menu:%d' % restaurant_id, 'detail', loader=load)
+
+
+def invalidate_restaurants():
+    """Call after any write that changes the restaurant list"""
+    cache.bump('restaurants')
+
+
+def invalidate_menu(restaurant_id):
+    """Call after any write that changes a restaurant or its menu"""
+    cache.bump('menu:%d' % restaurant_id)
+
+
+# Cached user identity for the Flask-Login user loader
+def load_user_cached(user_id):
+    """User for a session, without a database round trip on a cache hit
+
+    The cached identity is attached to the session as an already-persistent
+    object, so columns that are not cached (password_hash, created_at) and
+    relationships still load from the database on first access.
+    """
+    key = cache.key('user', user_id)
+    data = cache.get(key)
+    monitoring.cache_result('data', 'user', data is not None)
+    if data is None:
+        with primary():
+            user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        data = {'id': user.id, 'username': user.username, 'email': user.email,
+                'is_admin': user.is_admin}
+        cache.set(key, data, current_app.config.get('USER_CACHE_TTL'), local=False)
+        return user
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id):
+    cache.delete(cache.key('user', user_id))
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    # Any change to cached identity or credentials drops the cached copy once
+    # the transaction commits. Bulk query.update() calls bypass this hook and
+    # must call invalidate_user() themselves.
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes()
+           for name in ('username', 'email', 'is_admin', 'password_hash')):
+        state.session.info.setdefault('invalidate_users', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('invalidate_users', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_invalidations(session):
+    session.info.pop('invalidate_users', None)
@@ -0,0 +1,91 @@
+from flask import current_app
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CartItem, MenuItem, Order, OrderItem
+from rollups import record_order
+from events import order_events, order_event_data
+from tasks import notify_order_placed
+from pricing import ZERO, line_total, money
+
+
+class CheckoutError(Exception):
+    """Checkout could not go ahead; the message is safe to show the user"""
+
+
+def place_order(user_id, delivery_address, phone, idempotency_key=None):
+    """Turn a user's cart into an order in one transaction
+
+    Statements per order, independent of cart size: one locked read of the
+    cart joined to current menu prices, one INSERT for the order, one bulk
+    INSERT for its items, one DELETE for the cart and one upsert of the
+    dashboard rollups. Prices are snapshotted
+    from the same read, and unavailable items abort the whole checkout.
+
+    With an idempotency_key, a retried or double-submitted checkout returns
+    the order created by the first attempt instead of placing a second one.
+    Returns (order, created).
+    """
+    rows = db.session.execute(
+        select(CartItem.menu_item_id, CartItem.quantity, MenuItem.name, MenuItem.price,
+               MenuItem.is_available, MenuItem.restaurant_id)
+        .join(MenuItem, MenuItem.id == CartItem.menu_item_id)
+        .where(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+        # Serialises concurrent checkouts of the same cart (PostgreSQL only)
+        .with_for_update(of=CartItem)
+    ).all()
+
+    if not rows:
+        db.session.rollback()
+        # A concurrent or earlier submit with this key may have emptied the cart
+        existing = _order_for_key(user_id, idempotency_key)
+        if existing is not None:
+            return existing, False
+        raise CheckoutError('Your cart is empty')
+
+    unavailable = [row.name for row in rows if not row.is_available]
+    if unavailable:
+        db.session.rollback()
+        raise CheckoutError(f"No longer available: {', '.join(unavailable)}. "
+                            "Please remove them from your cart.")
+
+    totals = [line_total(row.price, row.quantity) for row in rows]
+    order = Order(
+        user_id=user_id,
+        total_amount=sum(totals, ZERO),
+        delivery_fee=money(current_app.config.get('DELIVERY_FEE', ZERO)),
+        delivery_address=delivery_address,
+        phone=phone,
+        status='pending',
+        idempotency_key=idempotency_key or None,
+    )
+    db.session.add(order)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Same key already used: the unique index rejected the duplicate
+        db.session.rollback()
+        existing = _order_for_key(user_id, idempotency_key)
+        if existing is None:
+            raise
+        return existing, False
+
+    db.session.execute(insert(OrderItem), [
+        {'order_id': order.id, 'menu_item_id': row.menu_item_id,
+         'quantity': row.quantity, 'price': row.price}
+        for row in rows
+    ])
+    db.session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+    record_order(order, [(row.restaurant_id, row.quantity, total) for row, total in zip(rows, totals)])
+    event = order_event_data(order)
+    db.session.commit()
+    order_events.publish_order('order_created', event)
+    notify_order_placed.delay(event['order_id'])
+    return order, True
+
+
+def _order_for_key(user_id, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Order.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
@@ -1,4 +1,5 @@
 import os
+from decimal import Decimal
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
@@ -20,10 +21,134 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool per worker process. A sync gunicorn worker runs one
+    # request at a time and needs few connections; gevent or threaded workers
+    # need about one per concurrent request. Connections are tested before use
+    # and replaced after DB_POOL_RECYCLE seconds. DB_STATEMENT_TIMEOUT (ms,
+    # PostgreSQL, 0 for none) cancels runaway queries; migrations ignore it.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': DB_POOL_RECYCLE}
+    if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                                         pool_timeout=DB_POOL_TIMEOUT)
+    if SQLALCHEMY_DATABASE_URI.startswith('postgresql') and DB_STATEMENT_TIMEOUT:
+        SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = {
+            'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'}
+    
+    # Read replicas: comma-separated database URLs with the same schema.
+    # Read-only views query a replica (see routing.py); a user's requests for
+    # READ_YOUR_WRITES_SECONDS after one of their writes stay on the primary.
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                             if url.strip()]
+    SQLALCHEMY_BINDS = {f'replica_{n}': url for n, url in enumerate(DATABASE_REPLICA_URLS)}
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+    REPLICA_RETRY_INTERVAL = int(os.environ.get('REPLICA_RETRY_INTERVAL', 30))
+    
     # Redis configuration
     REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
     REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
     REDIS_DB = int(os.environ.get('REDIS_DB', 0))
+    REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD') or None
+    
+    # Cache settings (falls back to an in-process cache if Redis is down)
+    CACHE_ENABLED = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'foodapp')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+    CACHE_LOCAL_TTL = int(os.environ.get('CACHE_LOCAL_TTL', 30))
+    CACHE_REDIS_TIMEOUT = float(os.environ.get('CACHE_REDIS_TIMEOUT', 0.2))
+    # Rendered template fragments: 'local' (per-process LRU) or 'redis'
+    FRAGMENT_CACHE_ENABLED = os.environ.get('FRAGMENT_CACHE_ENABLED', 'true').lower() == 'true'
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'local')
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 600))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    
+    # Server-side sessions in Redis, shared across workers and containers
+    SESSION_USE_REDIS = os.environ.get('SESSION_USE_REDIS', 'false').lower() == 'true'
+    SESSION_KEY_PREFIX = os.environ.get('SESSION_KEY_PREFIX', 'session')
+    
+    # Password hashing: werkzeug method string (e.g. 'scrypt' or
+    # 'pbkdf2:sha256:600000'). Changing it rehashes passwords on next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 2))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 2))
+    
+    # Failed-login throttling, checked before hashing
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', 20))
+    LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('LOGIN_MAX_FAILURES_PER_USER', 5))
+    
+    # Number of trusted proxies in front of the app (1 behind the bundled nginx)
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+    
+    # Orders per page on the admin order list
+    ADMIN_ORDERS_PAGE_SIZE = int(os.environ.get('ADMIN_ORDERS_PAGE_SIZE', 50))
+    
+    # Live order events (Server-Sent Events): keepalive interval and maximum
+    # stream length in seconds; browsers reconnect and resume after that
+    SSE_ENABLED = os.environ.get('SSE_ENABLED', 'true').lower() == 'true'
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT', 15))
+    SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 300))
+    
+    # Background jobs: queues and how many jobs of each may run at once
+    # across all workers, retries before a job is dead-lettered, base retry
+    # delay in seconds (doubled per attempt) and how long a worker may hold
+    # a job before it is handed to another worker
+    JOB_BACKEND = os.environ.get('JOB_BACKEND', 'redis')
+    JOB_QUEUES = {'default': 2, 'notifications': 4}
+    JOB_MAX_RETRIES = int(os.environ.get('JOB_MAX_RETRIES', 5))
+    JOB_RETRY_BACKOFF = int(os.environ.get('JOB_RETRY_BACKOFF', 5))
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+    JOB_LOCAL_WORKER = os.environ.get('JOB_LOCAL_WORKER', 'true').lower() == 'true'
+    
+    # Customer notifications: import path of a sender(user, subject, body)
+    # callable that delivers them (email, SMS...); unset, they are only logged
+    NOTIFICATION_SENDER = os.environ.get('NOTIFICATION_SENDER') or None
+    
+    # Flat delivery fee added to every order
+    DELIVERY_FEE = Decimal(os.environ.get('DELIVERY_FEE', '2.99'))
+    
+    # Bulk menu import: rows per INSERT / UPDATE batch
+    MENU_IMPORT_CHUNK_SIZE = int(os.environ.get('MENU_IMPORT_CHUNK_SIZE', 1000))
+    
+    # Days of daily sales shown on the admin dashboard
+    DASHBOARD_DAYS = int(os.environ.get('DASHBOARD_DAYS', 14))
+    
+    # Menu search: results per page and upper bounds of the price facet buckets
+    SEARCH_RESULTS_LIMIT = int(os.environ.get('SEARCH_RESULTS_LIMIT', 20))
+    SEARCH_PRICE_BUCKETS = (10, 20, 30)
+    
+    # Query budget: max SQL statements per request (None disables counting).
+    # QUERY_BUDGETS maps endpoint names to per-route limits; with
+    # QUERY_BUDGET_ASSERT an over-budget request raises instead of warning.
+    QUERY_BUDGET = int(os.environ['QUERY_BUDGET']) if os.environ.get('QUERY_BUDGET') else None
+    QUERY_BUDGETS = {}
+    QUERY_BUDGET_ASSERT = os.environ.get('QUERY_BUDGET_ASSERT', 'false').lower() == 'true'
+    
+    # Readiness checks (/readyz, /health) run in the background every
+    # HEALTH_CHECK_INTERVAL seconds. Without Redis the app falls back to
+    # in-process caching and cookie sessions, so it only fails readiness
+    # with HEALTH_REQUIRE_REDIS.
+    HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', 5))
+    HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', 2))
+    HEALTH_REQUIRE_REDIS = os.environ.get('HEALTH_REQUIRE_REDIS', 'false').lower() == 'true'
+    
+    # Prometheus metrics at /metrics (needs prometheus_client). With
+    # METRICS_TOKEN set, scrapers must send "Authorization: Bearer <token>".
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Slow request profiler: off unless PROFILE_SLOW_REQUESTS_MS is set.
+    # Stacks are sampled every PROFILE_INTERVAL_MS, and the newest
+    # PROFILE_KEEP profiles are kept in PROFILE_DIR.
+    PROFILE_SLOW_REQUESTS_MS = (int(os.environ['PROFILE_SLOW_REQUESTS_MS'])
+                                if os.environ.get('PROFILE_SLOW_REQUESTS_MS') else None)
+    PROFILE_INTERVAL_MS = int(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))
     
     # Flask settings
     FLASK_ENV = os.environ.get('FLASK_ENV', 'development')
@@ -0,0 +1,195 @@
+"""Live order events over Server-Sent Events
+
+Checkout and admin status changes publish to Redis pub/sub channels: one per
+customer and one for admins. Each event gets a sequence number from a Redis
+counter and is also kept in a short per-channel backlog, so a browser that
+reconnects with Last-Event-ID first replays what it missed and then continues
+with live messages. Without Redis, events are fanned out in-process, which
+only reaches clients connected to the same worker.
+
+A stream holds no database connection while open, and is closed after
+SSE_MAX_DURATION seconds (the browser reconnects and resumes). Serve it from
+gevent workers, see README.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from flask import Response
+
+from cache import cache, redis
+
+ADMIN_CHANNEL = 'admin'
+
+
+def user_channel(user_id):
+    return 'user:%d' % user_id
+
+
+def order_event_data(order):
+    return {
+        'order_id': order.id,
+        'user_id': order.user_id,
+        'status': order.status,
+        'total_amount': float(order.total_amount),
+        'updated_at': order.updated_at.isoformat() if order.updated_at else None,
+    }
+
+
+class LocalBroker:
+    """In-process fan-out used while Redis is unavailable"""
+
+    def __init__(self, max_events=1000):
+        self._events = deque(maxlen=max_events)
+        self._seq = 0
+        self._changed = threading.Condition()
+
+    def publish(self, channels, event, data):
+        with self._changed:
+            self._seq += 1
+            self._events.append({'id': self._seq, 'channels': channels, 'event': event, 'data': data})
+            self._changed.notify_all()
+
+    def wait(self, channels, last_id, timeout):
+        """Events on `channels` newer than last_id, waiting up to timeout for one"""
+        with self._changed:
+            if last_id is None or last_id > self._seq:
+                last_id = self._seq
+            self._changed.wait_for(lambda: self._seq > last_id, timeout)
+            return last_id, [e for e in self._events
+                             if e['id'] > last_id and set(e['channels']) & set(channels)]
+
+
+class OrderEvents:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.heartbeat = 15
+        self.max_duration = 300
+        self.retry_ms = 3000
+        self.backlog = 100
+        self.backlog_ttl = 3600
+        self.local = LocalBroker()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SSE_ENABLED', self.enabled)
+        self.heartbeat = app.config.get('SSE_HEARTBEAT', self.heartbeat)
+        self.max_duration = app.config.get('SSE_MAX_DURATION', self.max_duration)
+        self.retry_ms = app.config.get('SSE_RETRY_MS', self.retry_ms)
+        self.backlog = app.config.get('SSE_BACKLOG', self.backlog)
+        app.extensions['order_events'] = self
+
+    def _channel_key(self, channel):
+        return cache.key('events', channel)
+
+    def _backlog_key(self, channel):
+        return cache.key('events', channel, 'backlog')
+
+    # Publishing
+    def publish(self, channels, event, data):
+        """Send an event; never raises, a lost event only delays the page update"""
+        if not self.enabled:
+            return
+        client = cache.redis
+        if client is None:
+            self.local.publish(channels, event, data)
+            return
+        try:
+            seq = client.incr(cache.key('events', 'seq'))
+            message = json.dumps({'id': seq, 'event': event, 'data': data}, default=str)
+            pipe = client.pipeline(transaction=False)
+            for channel in channels:
+                pipe.zadd(self._backlog_key(channel), {message: seq})
+                pipe.zremrangebyrank(self._backlog_key(channel), 0, -self.backlog - 1)
+                pipe.expire(self._backlog_key(channel), self.backlog_ttl)
+                pipe.publish(self._channel_key(channel), message)
+            pipe.execute()
+        except redis.RedisError as e:
+            cache.redis_failed(e)
+            self.local.publish(channels, event, data)
+
+    def publish_order(self, event, data):
+        """Send an order_event_data() payload to its customer and to admins
+
+        Build the payload before committing and publish after, so listeners
+        never hear about uncommitted orders and no refresh query is needed.
+        """
+        self.publish([user_channel(data['user_id']), ADMIN_CHANNEL], event, data)
+
+    # Streaming
+    def _redis_events(self, client, channels, last_id):
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            # Subscribe before reading the backlog so nothing falls in between;
+            # the id check below drops anything seen twice
+            pubsub.subscribe(*[self._channel_key(c) for c in channels])
+            if last_id is not None:
+                pipe = client.pipeline(transaction=False)
+                for channel in channels:
+                    pipe.zrangebyscore(self._backlog_key(channel), '(%d' % last_id, '+inf')
+                missed = [json.loads(raw) for raws in pipe.execute() for raw in raws]
+                for message in sorted(missed, key=lambda m: m['id']):
+                    if message['id'] > last_id:
+                        last_id = message['id']
+                        yield message
+            while True:
+                raw = pubsub.get_message(timeout=1.0)
+                if raw is None:
+                    yield None
+                    continue
+                message = json.loads(raw['data'])
+                if last_id is None or message['id'] > last_id:
+                    last_id = message['id']
+                    yield message
+        except redis.RedisError as e:
+            # End the stream; the browser reconnects and resumes from its last id
+            cache.redis_failed(e)
+        finally:
+            pubsub.close()
+
+    def _local_events(self, channels, last_id):
+        while True:
+            last_id, messages = self.local.wait(channels, last_id, 1.0)
+            if not messages:
+                yield None
+            for message in messages:
+                last_id = message['id']
+                yield message
+
+    def _stream(self, channels, last_id):
+        yield f'retry: {self.retry_ms}\n\n'
+        client = cache.redis
+        source = (self._redis_events(client, channels, last_id) if client is not None
+                  else self._local_events(channels, last_id))
+        started = last_sent = time.monotonic()
+        try:
+            for message in source:
+                now = time.monotonic()
+                if message is not None:
+                    yield (f"id: {message['id']}\nevent: {message['event']}\n"
+                           f"data: {json.dumps(message['data'], default=str)}\n\n")
+                    last_sent = now
+                elif now - last_sent >= self.heartbeat:
+                    # Comment line: keeps proxies from timing out an idle stream
+                    yield ': keepalive\n\n'
+                    last_sent = now
+                if now - started >= self.max_duration:
+                    break
+        finally:
+            source.close()
+
+    def stream(self, channels, last_event_id=None):
+        try:
+            last_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_id = None
+        response = Response(self._stream(channels, last_id), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-store'
+        # Tell nginx to pass events through instead of buffering them
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+order_events = OrderEvents()
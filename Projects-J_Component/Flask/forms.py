@@ -1,5 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, FloatField, IntegerField, SelectField, BooleanField
+from flask_wtf.file import FileField, FileRequired
+from wtforms import StringField, PasswordField, TextAreaField, DecimalField, IntegerField, SelectField, BooleanField, HiddenField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, NumberRange
 
 class LoginForm(FlaskForm):
@@ -20,14 +21,20 @@ class RestaurantForm(FlaskForm):
     image_url = StringField('Image URL')
 
 class MenuItemForm(FlaskForm):
-    name = StringField('Item Name', validators=[DataRequired()])
+    name = StringField('Item Name', validators=[DataRequired(), Length(max=100)])
     description = TextAreaField('Description')
-    price = FloatField('Price', validators=[DataRequired(), NumberRange(min=0)])
-    category = StringField('Category')
-    image_url = StringField('Image URL')
+    price = DecimalField('Price', places=2, validators=[DataRequired(), NumberRange(min=0)])
+    category = StringField('Category', validators=[Length(max=50)])
+    image_url = StringField('Image URL', validators=[Length(max=255)])
     restaurant_id = SelectField('Restaurant', coerce=int, validators=[DataRequired()])
 
+class MenuImportForm(FlaskForm):
+    file = FileField('CSV or NDJSON file', validators=[FileRequired()])
+    format = SelectField('Format', choices=[('', 'From file extension'), ('csv', 'CSV'), ('ndjson', 'NDJSON')])
+    dry_run = BooleanField('Validate only (do not save)')
+
 class OrderForm(FlaskForm):
-    delivery_address = StringField('Delivery Address', validators=[DataRequired()])
-    phone = StringField('Phone Number', validators=[DataRequired()])
+    delivery_address = StringField('Delivery Address', validators=[DataRequired(), Length(max=200)])
+    phone = StringField('Phone Number', validators=[DataRequired(), Length(max=20)])
+    idempotency_key = HiddenField(validators=[Length(max=64)])
 
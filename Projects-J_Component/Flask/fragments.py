@@ -0,0 +1,99 @@
+"""Rendered-fragment cache for Jinja templates
+
+    {% cache 'menu-grid', 'menu:%d' % restaurant.id, current_user.is_authenticated %}
+        ... expensive markup ...
+    {% endcache %}
+
+The first argument names the fragment (for hit/miss stats), the second is the
+cache namespace whose version the admin write routes bump (see cache.py), and
+any further arguments become part of the key. Everything the block depends on
+that is not covered by the namespace (e.g. who is logged in) must be passed
+as a key argument.
+"""
+import threading
+from collections import defaultdict
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from cache import cache, LocalCache
+from monitoring import monitoring
+
+
+class FragmentCache:
+    def __init__(self, app=None):
+        self.backend = 'local'
+        self.ttl = 600
+        self.enabled = True
+        self.local = LocalCache(max_entries=2048)
+        self._stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = app.config.get('FRAGMENT_CACHE_BACKEND', self.backend)
+        self.ttl = app.config.get('FRAGMENT_CACHE_TTL', self.ttl)
+        self.enabled = app.config.get('FRAGMENT_CACHE_ENABLED', self.enabled)
+        self.local.max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', self.local.max_entries)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.extensions['fragment_cache'] = self
+
+    def _version(self, namespace):
+        # A page may hold many fragments of one namespace; look it up once
+        versions = g.setdefault('_fragment_versions', {})
+        if namespace not in versions:
+            versions[namespace] = cache.version(namespace)
+        return versions[namespace]
+
+    def _count(self, name, outcome):
+        with self._stats_lock:
+            self._stats[name][outcome] += 1
+        monitoring.cache_result('fragment', name, outcome == 'hits')
+
+    def render(self, name, namespace, parts, render):
+        """Return the cached fragment, rendering and storing it on a miss"""
+        if not self.enabled:
+            return render()
+        key = cache.key('fragment', name, namespace, 'v%d' % self._version(namespace), *parts)
+        html = self.local.get(key) if self.backend == 'local' else cache.get(key)
+        if html is not None:
+            self._count(name, 'hits')
+            return html
+        self._count(name, 'misses')
+        html = render()
+        # Without Redis the namespace versions are per worker, so another
+        # worker's invalidation is only picked up once the entry expires
+        ttl = self.ttl if cache.redis is not None else min(self.ttl, cache.local_ttl)
+        if self.backend == 'local':
+            self.local.set(key, str(html), ttl)
+        else:
+            cache.set(key, str(html), ttl)
+        return html
+
+    def stats(self):
+        """Hit/miss counts per fragment name for this process"""
+        with self._stats_lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
+
+
+fragment_cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_fragment', [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, args, caller):
+        name, namespace, *parts = args
+        return Markup(fragment_cache.render(name, namespace, parts, caller))
@@ -0,0 +1,42 @@
+"""Gunicorn settings for every service; gunicorn reads this file from the
+working directory, next to the command-line options
+
+With PROMETHEUS_MULTIPROC_DIR set, each worker writes its metrics to files
+there and /metrics sums them (see monitoring.py). The directory is emptied
+when gunicorn starts, so a restart does not count old workers twice.
+
+Gevent workers (the events service, or docker-compose.gevent.yml) make
+psycopg2 wait on the gevent hub, so a query in progress yields to the
+worker's other requests instead of blocking them all. Needs psycogreen
+(requirements-prod.txt).
+"""
+import os
+import shutil
+
+
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    if 'gevent' not in server.cfg.worker_class_str:
+        return
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen is not installed, PostgreSQL queries will block gevent workers")
+        return
+    patch_psycopg()
@@ -0,0 +1,150 @@
+"""Liveness and readiness probes
+
+    GET /livez   200 while the process can serve requests; does no I/O
+    GET /readyz  200 when the database answers, the schema is migrated and
+                 (with HEALTH_REQUIRE_REDIS) Redis answers; 503 otherwise
+    GET /health  the same as /readyz, for existing probes
+
+A background thread per worker runs the readiness checks every
+HEALTH_CHECK_INTERVAL seconds, each bounded by HEALTH_CHECK_TIMEOUT, and
+the probes only return its last result. Probes therefore cost no database
+or Redis round trip however often they come, and a slow database makes a
+probe answer 503 at once instead of holding a worker. A result that has not
+been refreshed for three intervals counts as not ready.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import jsonify
+
+from cache import cache
+from migrations import current_version, head_version
+
+
+class _Check:
+    """A check run in a daemon thread, never more than one run at a time
+
+    A run that hangs past the timeout keeps its thread, and later rounds
+    wait for that run instead of piling up more threads behind it.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.done = threading.Event()
+        self.done.set()
+        self.result = None
+
+    def start(self):
+        if self.done.is_set():
+            self.done = threading.Event()
+            threading.Thread(target=self._run, args=(self.done,), daemon=True).start()
+        return self.done
+
+    def _run(self, done):
+        try:
+            self.result = (self.func(), None)
+        except Exception as e:
+            self.result = (None, e)
+        done.set()
+
+
+class HealthMonitor:
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 5
+        self.timeout = 2
+        self.require_redis = False
+        self._result = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._database = _Check(self._check_database)
+        self._redis = _Check(self._check_redis)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('HEALTH_CHECK_INTERVAL', self.interval)
+        self.timeout = app.config.get('HEALTH_CHECK_TIMEOUT', self.timeout)
+        self.require_redis = app.config.get('HEALTH_REQUIRE_REDIS', self.require_redis)
+        app.extensions['health'] = self
+        app.add_url_rule('/livez', 'livez', lambda: jsonify({'status': 'alive'}))
+        app.add_url_rule('/readyz', 'readyz', self.readiness_view)
+        app.add_url_rule('/health', 'health_check', self.readiness_view)
+
+    # Checks
+    def _check_database(self):
+        with self.app.app_context():
+            version = current_version()
+        if version < head_version():
+            return 'healthy', f'version {version}, expected {head_version()}'
+        return 'healthy', 'current'
+
+    def _check_redis(self):
+        answered = cache.ping()
+        if answered is None:
+            return 'disabled'
+        return 'healthy' if answered else 'unavailable'
+
+    def _wait(self, check, deadline):
+        """(value, error) of a started check, or (None, message) if it is still running"""
+        if not check.done.wait(max(deadline - time.monotonic(), 0)):
+            return None, f'no answer within {self.timeout}s'
+        return check.result
+
+    def check(self):
+        """Run the checks now (in parallel, within the timeout) and keep the result"""
+        deadline = time.monotonic() + self.timeout
+        self._database.start()
+        self._redis.start()
+        result = {}
+        value, error = self._wait(self._database, deadline)
+        result['database'], result['schema'] = value or (f'unhealthy: {error}', 'unknown')
+        value, error = self._wait(self._redis, deadline)
+        result['redis'] = value or f'unavailable: {error}'
+        result['checked_at'] = datetime.utcnow().isoformat()
+        self._result, self._checked = result, time.monotonic()
+        return result
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Health check failed: {e}")
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Started on the first probe, so every gunicorn worker runs its own
+            # and CLI commands run none
+            self.check()
+            self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+            self._thread.start()
+
+    # Probes
+    def status(self):
+        """(ready, details) from the last check"""
+        if self._thread is None:
+            self._start()
+        result = dict(self._result)
+        if time.monotonic() - self._checked > 3 * self.interval + self.timeout:
+            result['database'] = 'unknown: health checks are not running'
+        redis_ok = result['redis'] in ('healthy', 'disabled') or not self.require_redis
+        ready = result['database'] == 'healthy' and result['schema'] == 'current' and redis_ok
+        return ready, result
+
+    def readiness_view(self):
+        ready, result = self.status()
+        return jsonify({
+            'status': 'healthy' if ready else 'degraded',
+            **result,
+            'timestamp': datetime.utcnow().isoformat(),
+        }), 200 if ready else 503
+
+
+health = HealthMonitor()
@@ -0,0 +1,370 @@
+"""Background job queue
+
+Request handlers only enqueue; a separate worker process runs the jobs:
+
+    @jobs.task(queue='notifications')
+    def notify_order_placed(order_id):
+        ...
+
+    notify_order_placed.delay(order.id)
+
+    flask jobs work                  # run workers for every queue in JOB_QUEUES
+    flask jobs stats                 # ready / delayed / running / dead per queue
+    flask jobs dead QUEUE            # inspect dead-lettered jobs
+    flask jobs retry-dead QUEUE      # put them back on the queue
+
+Jobs are stored in Redis. A reserved job holds a lease for
+JOB_LEASE_SECONDS; if its worker dies the job becomes available again, so
+delivery is at-least-once and tasks should be idempotent. Failed jobs are
+retried with exponential backoff and move to the queue's dead-letter list
+after JOB_MAX_RETRIES retries. JOB_QUEUES caps how many jobs of each queue
+run at once across all workers.
+
+Without Redis (or with JOB_BACKEND=memory) jobs go to an in-process backend
+with the same semantics, run by a worker thread inside the web process; tests
+set JOB_LOCAL_WORKER=False and call jobs.drain() instead.
+"""
+import heapq
+import json
+import random
+import signal
+import threading
+import time
+import traceback
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime
+
+import click
+
+from cache import cache, redis
+
+DEFAULT_QUEUE = 'default'
+
+
+class MemoryBackend:
+    """In-process queues, used without Redis and in tests"""
+
+    def __init__(self, max_dead=1000):
+        self.max_dead = max_dead
+        self._lock = threading.Lock()
+        self._ready = defaultdict(deque)
+        self._delayed = defaultdict(list)
+        self._running = defaultdict(set)
+        self._dead = defaultdict(deque)
+
+    def push(self, queue, raw, run_at=None):
+        with self._lock:
+            if run_at is None:
+                self._ready[queue].appendleft(raw)
+            else:
+                heapq.heappush(self._delayed[queue], (run_at, raw))
+
+    def reserve(self, queue, limit, lease):
+        with self._lock:
+            delayed = self._delayed[queue]
+            while delayed and delayed[0][0] <= time.time():
+                self._ready[queue].appendleft(heapq.heappop(delayed)[1])
+            if len(self._running[queue]) >= limit or not self._ready[queue]:
+                return None
+            raw = self._ready[queue].pop()
+            self._running[queue].add(raw)
+            return raw
+
+    def finish(self, queue, raw, retry=None, dead=None):
+        """Release a reserved job, optionally rescheduling or dead-lettering it"""
+        with self._lock:
+            self._running[queue].discard(raw)
+            if retry is not None:
+                heapq.heappush(self._delayed[queue], (retry[1], retry[0]))
+            if dead is not None:
+                self._dead[queue].appendleft(dead)
+                while len(self._dead[queue]) > self.max_dead:
+                    self._dead[queue].pop()
+
+    def stats(self, queue):
+        with self._lock:
+            return {'ready': len(self._ready[queue]), 'delayed': len(self._delayed[queue]),
+                    'running': len(self._running[queue]), 'dead': len(self._dead[queue])}
+
+    def dead_jobs(self, queue, limit):
+        with self._lock:
+            return list(self._dead[queue])[:limit]
+
+    def requeue_dead(self, queue):
+        with self._lock:
+            count = len(self._dead[queue])
+            while self._dead[queue]:
+                self._ready[queue].appendleft(self._dead[queue].pop())
+            return count
+
+
+# Moves due retries and expired leases back to the ready list, then reserves
+# one job if fewer than `limit` are running. Runs atomically inside Redis.
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, raw in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now, 'LIMIT', 0, 100)) do
+    redis.call('ZREM', KEYS[3], raw)
+    redis.call('RPUSH', KEYS[1], raw)
+end
+for _, raw in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, 100)) do
+    redis.call('ZREM', KEYS[2], raw)
+    redis.call('LPUSH', KEYS[1], raw)
+end
+if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[2]) then
+    return false
+end
+local raw = redis.call('RPOP', KEYS[1])
+if raw then
+    redis.call('ZADD', KEYS[3], now + tonumber(ARGV[3]), raw)
+end
+return raw
+"""
+
+
+class RedisBackend:
+    """Queues shared by every web and worker process
+
+    Per queue: a ready list, a delayed sorted set (retries, by run time), a
+    leases sorted set (running jobs, by lease expiry) and a dead list.
+    """
+
+    def __init__(self, max_dead=1000):
+        self.max_dead = max_dead
+
+    def _keys(self, queue):
+        return [cache.key('jobs', queue, part) for part in ('ready', 'delayed', 'leases', 'dead')]
+
+    @property
+    def client(self):
+        client = cache.redis
+        if client is None:
+            raise redis.ConnectionError('Redis is unavailable')
+        return client
+
+    def push(self, queue, raw, run_at=None):
+        ready, delayed, _, _ = self._keys(queue)
+        if run_at is None:
+            self.client.lpush(ready, raw)
+        else:
+            self.client.zadd(delayed, {raw: run_at})
+
+    def reserve(self, queue, limit, lease):
+        ready, delayed, leases, _ = self._keys(queue)
+        raw = self.client.eval(RESERVE_SCRIPT, 3, ready, delayed, leases, time.time(), limit, lease)
+        return raw.decode() if raw is not None else None
+
+    def finish(self, queue, raw, retry=None, dead=None):
+        _, delayed, leases, dead_list = self._keys(queue)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zrem(leases, raw)
+        if retry is not None:
+            pipe.zadd(delayed, {retry[0]: retry[1]})
+        if dead is not None:
+            pipe.lpush(dead_list, dead)
+            pipe.ltrim(dead_list, 0, self.max_dead - 1)
+        pipe.execute()
+
+    def stats(self, queue):
+        ready, delayed, leases, dead = self._keys(queue)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.llen(ready)
+        pipe.zcard(delayed)
+        pipe.zcard(leases)
+        pipe.llen(dead)
+        return dict(zip(('ready', 'delayed', 'running', 'dead'), pipe.execute()))
+
+    def dead_jobs(self, queue, limit):
+        return [raw.decode() for raw in self.client.lrange(self._keys(queue)[3], 0, limit - 1)]
+
+    def requeue_dead(self, queue):
+        ready, _, _, dead = self._keys(queue)
+        count = 0
+        while self.client.rpoplpush(dead, ready) is not None:
+            count += 1
+        return count
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.tasks = {}
+        self.queues = {DEFAULT_QUEUE: 1}
+        self.max_retries = 5
+        self.backoff = 5
+        self.max_backoff = 600
+        self.lease = 300
+        self.poll_interval = 1.0
+        self.use_redis = True
+        self.local_worker = True
+        self.redis_backend = RedisBackend()
+        self.local = MemoryBackend()
+        self._local_threads = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.queues = dict(app.config.get('JOB_QUEUES', self.queues))
+        self.max_retries = app.config.get('JOB_MAX_RETRIES', self.max_retries)
+        self.backoff = app.config.get('JOB_RETRY_BACKOFF', self.backoff)
+        self.max_backoff = app.config.get('JOB_MAX_BACKOFF', self.max_backoff)
+        self.lease = app.config.get('JOB_LEASE_SECONDS', self.lease)
+        self.use_redis = app.config.get('JOB_BACKEND', 'redis') == 'redis' and redis is not None
+        self.local_worker = app.config.get('JOB_LOCAL_WORKER', self.local_worker)
+        app.extensions['jobs'] = self
+        self._register_commands(app)
+
+    def task(self, queue=DEFAULT_QUEUE, max_retries=None):
+        """Register a function as a job; call it in the background with .delay()"""
+        def decorator(func):
+            name = f'{func.__module__}.{func.__name__}'
+            self.tasks[name] = {'func': func, 'queue': queue, 'max_retries': max_retries}
+            func.delay = lambda *args, **kwargs: self.enqueue(name, *args, **kwargs)
+            return func
+        return decorator
+
+    # Enqueueing (request path)
+    def enqueue(self, name, *args, **kwargs):
+        """Queue a call to a registered task; arguments must be JSON-serialisable"""
+        queue = self.tasks[name]['queue']
+        job_id = uuid.uuid4().hex
+        raw = json.dumps({'id': job_id, 'task': name, 'args': args, 'kwargs': kwargs,
+                          'attempts': 0, 'enqueued_at': datetime.utcnow().isoformat()})
+        if self.use_redis and cache.redis is not None:
+            try:
+                self.redis_backend.push(queue, raw)
+                return job_id
+            except redis.RedisError as e:
+                cache.redis_failed(e)
+        # No shared queue: run it in this process rather than lose it
+        self.local.push(queue, raw)
+        self._start_local_worker()
+        return job_id
+
+    # Running
+    def _backoff(self, attempts):
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def process_one(self, backend, queue):
+        """Reserve and run one job; False if none was available"""
+        raw = backend.reserve(queue, self.queues.get(queue, 1), self.lease)
+        if raw is None:
+            return False
+        job = json.loads(raw)
+        task = self.tasks.get(job['task'])
+        try:
+            if task is None:
+                raise LookupError(f"Unknown task {job['task']}")
+            with self.app.app_context():
+                task['func'](*job['args'], **job['kwargs'])
+        except Exception as e:
+            job['attempts'] += 1
+            job['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            max_retries = self.max_retries if task is None or task['max_retries'] is None else task['max_retries']
+            if task is None or job['attempts'] > max_retries:
+                job['failed_at'] = datetime.utcnow().isoformat()
+                job['traceback'] = traceback.format_exc(limit=10)
+                print(f"Job {job['id']} ({job['task']}) moved to dead letters: {job['error']}")
+                backend.finish(queue, raw, dead=json.dumps(job))
+            else:
+                run_at = time.time() + self._backoff(job['attempts'])
+                print(f"Job {job['id']} ({job['task']}) failed, retry {job['attempts']}: {job['error']}")
+                backend.finish(queue, raw, retry=(json.dumps(job), run_at))
+        else:
+            backend.finish(queue, raw)
+        return True
+
+    def _work_loop(self, backend, queue, stop):
+        while not stop.is_set():
+            try:
+                worked = self.process_one(backend, queue)
+            except redis.RedisError as e:
+                print(f"Job worker for {queue} lost Redis, retrying: {e}")
+                stop.wait(cache.retry_interval)
+                continue
+            if not worked:
+                stop.wait(self.poll_interval)
+
+    def _start_local_worker(self):
+        if not self.local_worker:
+            return
+        # Started on first use so that forked web workers each get their own
+        with self._lock:
+            if self._local_threads is not None:
+                return
+            stop = threading.Event()
+            self._local_threads = [
+                threading.Thread(target=self._work_loop, args=(self.local, queue, stop),
+                                 name=f'jobs-{queue}', daemon=True)
+                for queue in self.queues]
+            for thread in self._local_threads:
+                thread.start()
+
+    def work(self, queues=None):
+        """Run worker threads (JOB_QUEUES[queue] per queue) until SIGINT/SIGTERM"""
+        queues = queues or list(self.queues)
+        backend = self.redis_backend if self.use_redis else self.local
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._work_loop, args=(backend, queue, stop),
+                                    name=f'jobs-{queue}-{n}')
+                   for queue in queues for n in range(self.queues.get(queue, 1))]
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        for thread in threads:
+            thread.start()
+        print(f"Job worker started for {', '.join(queues)}")
+        # Running jobs finish before the threads exit
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+
+    def drain(self, backend=None):
+        """Run every job that is ready now, in this thread (for tests)"""
+        backend = backend or self.local
+        ran = 0
+        while any(self.process_one(backend, queue) for queue in self.queues):
+            ran += 1
+        return ran
+
+    def backend(self):
+        return self.redis_backend if self.use_redis else self.local
+
+    def _register_commands(self, app):
+        @app.cli.group('jobs')
+        def jobs_cli():
+            """Background job queue"""
+
+        @jobs_cli.command('work')
+        @click.option('--queue', '-q', 'queues', multiple=True, help='Queue to work (default: all)')
+        def work_command(queues):
+            """Run a job worker"""
+            self.work(list(queues) or None)
+
+        @jobs_cli.command('stats')
+        def stats_command():
+            """Show job counts per queue"""
+            for queue in self.queues:
+                counts = self.backend().stats(queue)
+                click.echo(f"{queue}: " + ', '.join(f'{k}={v}' for k, v in counts.items()))
+
+        @jobs_cli.command('dead')
+        @click.argument('queue')
+        @click.option('--limit', default=20)
+        def dead_command(queue, limit):
+            """List dead-lettered jobs, newest first"""
+            for raw in self.backend().dead_jobs(queue, limit):
+                job = json.loads(raw)
+                click.echo(f"{job['id']} {job['task']} attempts={job['attempts']} "
+                           f"failed_at={job.get('failed_at')} error={job.get('error')}")
+
+        @jobs_cli.command('retry-dead')
+        @click.argument('queue')
+        def retry_dead_command(queue):
+            """Move a queue's dead-lettered jobs back onto it"""
+            click.echo(f'Requeued {self.backend().requeue_dead(queue)} job(s)')
+
+
+jobs = JobQueue()
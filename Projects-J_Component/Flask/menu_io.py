@@ -0,0 +1,343 @@
+"""Bulk menu import and export as CSV or NDJSON (one JSON object per line)
+
+    flask menu import items.csv            # or items.ndjson, or - for stdin
+    flask menu import items.csv --dry-run  # validate only
+    flask menu export --format ndjson --restaurant-id 3 > items.ndjson
+
+Import reads, validates and writes one row at a time, so memory use does
+not grow with the file. Rows are checked with the MenuItemForm rules and
+written with bulk INSERT / UPDATE statements every MENU_IMPORT_CHUNK_SIZE
+rows, all in one transaction. A row updates the menu item with the same
+restaurant and name, if there is one. The restaurant is given by
+`restaurant_id`, or by `restaurant` name; an unknown name is created, in the
+same transaction, when its first valid row is accepted. An empty or missing
+`is_available` leaves an existing item's availability as it is (new items
+are available). Invalid rows are skipped and reported with their line number.
+
+Bulk statements bypass the ORM flush hooks, so the search index and the
+menu caches of every restaurant touched are refreshed explicitly at the end.
+Export streams the same columns with yield_per, so its output can be
+imported again.
+"""
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import insert, select, update
+from werkzeug.datastructures import MultiDict
+
+from cache import invalidate_menu, invalidate_restaurants
+from forms import MenuItemForm
+from models import db, MenuItem, Restaurant
+from pricing import money
+import search
+
+COLUMNS = ['restaurant_id', 'restaurant', 'name', 'description', 'price', 'category',
+           'image_url', 'is_available']
+FORMATS = ('csv', 'ndjson')
+FORM_FIELDS = ('restaurant_id', 'name', 'description', 'price', 'category', 'image_url')
+MAX_REPORTED_ERRORS = 100
+# Stands in for a restaurant that a row names but that does not exist yet
+NEW_RESTAURANT = -1
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.created_restaurants = 0
+        self.error_count = 0
+        # Only the first MAX_REPORTED_ERRORS are kept, as (line, message)
+        self.errors = []
+        self.restaurant_ids = set()
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return (f"{self.inserted} inserted, {self.updated} updated, "
+                f"{self.created_restaurants} restaurant(s) created, {self.error_count} error(s)")
+
+
+def format_for(filename, default='csv'):
+    """Guess the format from a file name"""
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return default
+
+
+# Reading
+def read_rows(stream, fmt='csv'):
+    """Yield (line number, row dict) from a text stream
+
+    A line that cannot be parsed yields a ValueError in place of the row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            row = ValueError('Expected a JSON object')
+        yield line_number, row
+
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+FALSE_VALUES = ('0', 'false', 'no', 'n')
+
+
+def _flag(value):
+    """True or False for a yes/no cell, None if empty; ValueError if unrecognised"""
+    if value is None or isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if not text:
+        return None
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f'is_available: expected one of {", ".join(TRUE_VALUES + FALSE_VALUES)}')
+
+
+class _Importer:
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.result = ImportResult()
+        self.chunk = {}
+        restaurants = db.session.execute(select(Restaurant.id, Restaurant.name)).all()
+        self.restaurant_names = {r.name: r.id for r in restaurants}
+        self.choices = [(r.id, r.name) for r in restaurants]
+        # One form, re-processed per row: building a form costs more than validating it
+        self.form = MenuItemForm(formdata=None, meta={'csrf': False})
+        self.form.restaurant_id.choices = self.choices
+
+    def _create_restaurant(self, name):
+        restaurant = Restaurant(name=name, is_active=True)
+        db.session.add(restaurant)
+        db.session.flush()
+        self.restaurant_names[name] = restaurant.id
+        self.choices.append((restaurant.id, name))
+        self.result.created_restaurants += 1
+        return restaurant.id
+
+    def _validate(self, row):
+        """Form-validated column values, or a list of error messages
+
+        A restaurant named by the row but not found is only created once
+        the rest of the row is valid.
+        """
+        data = {field: row.get(field) for field in FORM_FIELDS}
+        try:
+            is_available = _flag(row.get('is_available'))
+        except ValueError as e:
+            return [str(e)]
+        new_restaurant = None
+        if data['restaurant_id'] in (None, ''):
+            name = (row.get('restaurant') or '').strip()
+            data['restaurant_id'] = self.restaurant_names.get(name) if name else None
+            if name and data['restaurant_id'] is None:
+                max_length = Restaurant.name.type.length
+                if len(name) > max_length:
+                    return [f'restaurant: Field cannot be longer than {max_length} characters.']
+                new_restaurant, data['restaurant_id'] = name, NEW_RESTAURANT
+        formdata = MultiDict({k: str(v) for k, v in data.items() if v is not None})
+        form = self.form
+        if new_restaurant:
+            # form.restaurant_id.choices is self.choices
+            self.choices.append((NEW_RESTAURANT, new_restaurant))
+        try:
+            form.process(formdata)
+            valid = form.validate()
+        finally:
+            if new_restaurant:
+                self.choices.pop()
+        if not valid:
+            return [f'{name}: {messages[0]}' for name, messages in form.errors.items()]
+        restaurant_id = self._create_restaurant(new_restaurant) if new_restaurant else form.restaurant_id.data
+        values = {
+            'restaurant_id': restaurant_id,
+            'name': form.name.data.strip(),
+            'description': form.description.data or None,
+            'price': money(form.price.data),
+            'category': form.category.data or None,
+            'image_url': form.image_url.data or None,
+        }
+        # Without a value, updates keep the item's availability and inserts default to available
+        if is_available is not None:
+            values['is_available'] = is_available
+        return values
+
+    def add(self, line, row):
+        if isinstance(row, Exception):
+            self.result.error(line, str(row))
+            return
+        values = self._validate(row)
+        if isinstance(values, list):
+            self.result.error(line, '; '.join(values))
+            return
+        # A later row for the same item wins
+        self.chunk[(values['restaurant_id'], values['name'])] = values
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk:
+            return
+        rows, self.chunk = self.chunk, {}
+        existing = {(r.restaurant_id, r.name): r.id for r in db.session.execute(
+            select(MenuItem.id, MenuItem.restaurant_id, MenuItem.name)
+            .where(MenuItem.restaurant_id.in_({key[0] for key in rows}),
+                   MenuItem.name.in_({key[1] for key in rows}))
+        )}
+        updates = [dict(values, id=existing[key]) for key, values in rows.items() if key in existing]
+        inserts = [dict({'is_available': True}, **values) for key, values in rows.items()
+                   if key not in existing]
+        if updates:
+            db.session.execute(update(MenuItem), updates)
+        if inserts:
+            db.session.execute(insert(MenuItem), inserts)
+        self.result.updated += len(updates)
+        self.result.inserted += len(inserts)
+        self.result.restaurant_ids.update(key[0] for key in rows)
+
+
+def import_menu(rows, dry_run=False, chunk_size=None):
+    """Import (line, row) pairs from read_rows() and return an ImportResult
+
+    Valid rows are committed together; with dry_run everything is rolled
+    back, so the result only reports what would happen.
+    """
+    chunk_size = chunk_size or current_app.config.get('MENU_IMPORT_CHUNK_SIZE', 1000)
+    importer = _Importer(chunk_size)
+    try:
+        for line, row in rows:
+            importer.add(line, row)
+        importer.flush()
+        result = importer.result
+        conn = db.session.connection()
+        for restaurant_id in sorted(result.restaurant_ids):
+            search.reindex_restaurant(conn, restaurant_id)
+    except Exception:
+        db.session.rollback()
+        raise
+    if dry_run:
+        db.session.rollback()
+        return result
+    db.session.commit()
+    for restaurant_id in result.restaurant_ids:
+        invalidate_menu(restaurant_id)
+    if result.created_restaurants:
+        invalidate_restaurants()
+    return result
+
+
+# Exporting
+def export_rows(restaurant_id=None, batch_size=1000):
+    """Menu items as dicts with COLUMNS keys, fetched batch_size at a time"""
+    stmt = (select(MenuItem.restaurant_id, Restaurant.name.label('restaurant'), MenuItem.name,
+                   MenuItem.description, MenuItem.price, MenuItem.category, MenuItem.image_url,
+                   MenuItem.is_available)
+            .join(Restaurant, Restaurant.id == MenuItem.restaurant_id)
+            .order_by(MenuItem.restaurant_id, MenuItem.id)
+            .execution_options(yield_per=batch_size))
+    if restaurant_id:
+        stmt = stmt.where(MenuItem.restaurant_id == restaurant_id)
+    for row in db.session.execute(stmt):
+        yield row._asdict()
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
+
+
+def serialize_chunks(rows, columns, fmt='csv', rows_per_chunk=500):
+    """Write dict rows as CSV (with a header row) or NDJSON
+
+    Yields text chunks of about rows_per_chunk rows, so a streamed response
+    or file write never holds more than one chunk.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, lineterminator='\n') if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, default=_json_value) + '\n')
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def download_response(chunks, fmt, name):
+    """Stream chunks as a file download (chunked transfer encoding)"""
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+
+def export_chunks(fmt='csv', restaurant_id=None):
+    return serialize_chunks(export_rows(restaurant_id), COLUMNS, fmt)
+
+
+def export_response(fmt='csv', restaurant_id=None):
+    return download_response(export_chunks(fmt, restaurant_id), fmt, f"menu-{restaurant_id or 'all'}")
+
+
+def init_menu_io(app):
+    """Register the `flask menu` commands"""
+
+    @app.cli.group('menu')
+    def menu_cli():
+        """Bulk menu import and export"""
+
+    @menu_cli.command('import')
+    @click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+                  help='Defaults to the file extension, else csv')
+    @click.option('--dry-run', is_flag=True, help='Validate and report without writing')
+    def import_command(source, fmt, dry_run):
+        """Import menu items from a CSV or NDJSON file"""
+        fmt = fmt or format_for(source.name)
+        result = import_menu(read_rows(source, fmt), dry_run=dry_run)
+        for line, message in result.errors:
+            click.echo(f'line {line}: {message}', err=True)
+        if result.error_count > len(result.errors):
+            click.echo(f'... and {result.error_count - len(result.errors)} more', err=True)
+        click.echo(('Dry run: ' if dry_run else '') + result.summary())
+        if result.error_count:
+            sys.exit(1)
+
+    @menu_cli.command('export')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv')
+    @click.option('--restaurant-id', type=int, default=None)
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+    def export_command(fmt, restaurant_id, output):
+        """Export menu items as CSV or NDJSON"""
+        for chunk in export_chunks(fmt, restaurant_id):
+            output.write(chunk)
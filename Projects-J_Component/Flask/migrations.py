@@ -0,0 +1,385 @@
+"""Versioned schema migrations
+
+Each migration is a function registered with @migration(version, ...) and is
+applied once, in version order; applied versions are recorded in the
+schema_migrations table. Migrations must be safe to run against a database
+that db.create_all() already built, so they use IF NOT EXISTS / checkfirst.
+
+On PostgreSQL, migrations marked transactional=False run in autocommit mode
+so that indexes can be built with CREATE INDEX CONCURRENTLY, which does not
+lock the table against writes; their data changes that must apply together
+go in a `with transaction(conn):` block.
+
+    flask db init        # wait for the database, migrate and seed (deploy step)
+    flask db upgrade     # apply pending migrations
+    flask db current     # show the applied and latest versions
+
+Web workers never migrate: they start without touching the database, and
+/health reports them ready once the schema is at the version they expect.
+`flask db init` and `flask db upgrade` hold a PostgreSQL advisory lock, so
+when several of them start at once they run one after the other and the
+later ones find nothing to do.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex
+
+from models import db, User, Restaurant, MenuItem, CartItem, Order, OrderItem, DashboardRollup
+import rollups
+import search
+
+MIGRATIONS = []
+
+# Any constant works, as long as every process of this app uses the same one
+MIGRATION_LOCK_KEY = 0x666f6f64
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+class Migration:
+    def __init__(self, version, description, func, transactional=True):
+        self.version = version
+        self.description = description
+        self.func = func
+        self.transactional = transactional
+
+
+def migration(version, description, transactional=True):
+    """Register a migration function taking a connection"""
+    def decorator(func):
+        MIGRATIONS.append(Migration(version, description, func, transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+
+def head_version():
+    """Version of the latest known migration"""
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(engine=None):
+    """Highest applied migration version, 0 for an unmigrated database"""
+    engine = engine or db.engine
+    with engine.connect() as conn:
+        if not inspect(conn).has_table('schema_migrations'):
+            return 0
+        version = conn.execute(db.select(db.func.max(schema_migrations.c.version))).scalar()
+        return version or 0
+
+
+def upgrade(engine=None):
+    """Apply all pending migrations, returning the list of versions applied"""
+    engine = engine or db.engine
+    _metadata.create_all(engine, checkfirst=True)
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= current_version(engine):
+            continue
+        print(f"Applying migration {m.version}: {m.description}")
+        if m.transactional or engine.dialect.name != 'postgresql':
+            with engine.begin() as conn:
+                _no_statement_timeout(conn, local=True)
+                m.func(conn)
+                _record(conn, m)
+        else:
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                _no_statement_timeout(conn)
+                try:
+                    m.func(conn)
+                    _record(conn, m)
+                finally:
+                    conn.execute(text('RESET statement_timeout'))
+        applied.append(m.version)
+    return applied
+
+
+@contextmanager
+def migration_lock(engine=None):
+    """Hold a database-wide lock while migrating or seeding
+
+    A session-level advisory lock on PostgreSQL, released when the block
+    exits or the process dies. Other databases are not locked.
+    """
+    engine = engine or db.engine
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        # Waiting for another process's migrations may take a while
+        _no_statement_timeout(conn)
+        conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            conn.execute(text('RESET statement_timeout'))
+
+
+def wait_for_database(engine=None, retries=30, delay=2):
+    """Retry until the database accepts connections, e.g. while its container starts"""
+    engine = engine or db.engine
+    for attempt in range(retries):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            return
+        except OperationalError as e:
+            if attempt == retries - 1:
+                raise
+            print(f"Database not ready (attempt {attempt + 1}/{retries}): {e}. Retrying in {delay} seconds...")
+            time.sleep(delay)
+
+
+def setup(seed=None, engine=None):
+    """Wait for the database, apply pending migrations and run `seed`, under the lock"""
+    engine = engine or db.engine
+    wait_for_database(engine)
+    with migration_lock(engine):
+        applied = upgrade(engine)
+        if seed is not None:
+            seed()
+    return applied
+
+
+def _no_statement_timeout(conn, local=False):
+    # Migrations may rewrite big tables; DB_STATEMENT_TIMEOUT is meant for requests.
+    # SET LOCAL ends with the transaction, otherwise the caller RESETs.
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(f"SET {'LOCAL ' if local else ''}statement_timeout = 0"))
+
+
+def _record(conn, m):
+    conn.execute(schema_migrations.insert().values(
+        version=m.version, description=m.description, applied_at=datetime.utcnow()))
+
+
+# Helpers for migration bodies
+@contextmanager
+def transaction(conn):
+    """Run the block in one transaction, also inside an autocommit migration"""
+    if conn.get_execution_options().get('isolation_level') != 'AUTOCOMMIT':
+        # Transactional migrations already run in one
+        yield
+        return
+    conn.exec_driver_sql('BEGIN')
+    try:
+        yield
+    except BaseException:
+        conn.exec_driver_sql('ROLLBACK')
+        raise
+    conn.exec_driver_sql('COMMIT')
+
+
+def create_table(conn, model):
+    model.__table__.create(conn, checkfirst=True)
+
+
+def add_column(conn, model, name):
+    """Add a nullable model column if missing (no table rewrite on PostgreSQL)"""
+    table = model.__tablename__
+    if name in {c['name'] for c in inspect(conn).get_columns(table)}:
+        return
+    column_type = model.__table__.c[name].type.compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {column_type}')
+
+
+def create_index(conn, index):
+    """Create a model-declared index if missing, concurrently on PostgreSQL"""
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    if conn.dialect.name == 'postgresql':
+        # A failed concurrent build leaves an INVALID index behind, which
+        # IF NOT EXISTS would then silently accept
+        invalid = conn.exec_driver_sql(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = %(name)s AND NOT i.indisvalid", {'name': index.name}).first()
+        if invalid:
+            conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+        ddl = ddl.replace('INDEX IF NOT EXISTS', 'INDEX CONCURRENTLY IF NOT EXISTS', 1)
+    conn.exec_driver_sql(ddl)
+
+
+def model_index(model, name):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+
+# Migrations
+@migration(1, 'Initial schema')
+def initial_schema(conn):
+    for model in (User, Restaurant, MenuItem, CartItem, Order, OrderItem):
+        create_table(conn, model)
+
+
+@migration(2, 'Indexes for hot query paths and unique cart items', transactional=False)
+def hot_path_indexes(conn):
+    # Merge duplicate cart rows so the unique index can be built. Both steps
+    # commit together: merged quantities must never coexist with the duplicates
+    with transaction(conn):
+        conn.exec_driver_sql(
+            "UPDATE cart_item SET quantity = ("
+            " SELECT SUM(c2.quantity) FROM cart_item c2"
+            " WHERE c2.user_id = cart_item.user_id AND c2.menu_item_id = cart_item.menu_item_id)"
+            " WHERE id IN (SELECT MIN(id) FROM cart_item GROUP BY user_id, menu_item_id HAVING COUNT(*) > 1)")
+        conn.exec_driver_sql(
+            "DELETE FROM cart_item WHERE id NOT IN ("
+            " SELECT MIN(id) FROM cart_item GROUP BY user_id, menu_item_id)")
+
+    for model, name in [
+        (CartItem, 'uq_cart_item_user_menu_item'),
+        (CartItem, 'ix_cart_item_menu_item_id'),
+        (Order, 'ix_order_user_id_created_at'),
+        (Order, 'ix_order_created_at_id'),
+        (Order, 'ix_order_status_created_at_id'),
+        (OrderItem, 'ix_order_item_order_id'),
+        (OrderItem, 'ix_order_item_menu_item_id'),
+        (MenuItem, 'ix_menu_item_restaurant_category'),
+        (MenuItem, 'ix_menu_item_available_restaurant'),
+    ]:
+        create_index(conn, model_index(model, name))
+
+
+@migration(3, 'Checkout idempotency keys', transactional=False)
+def order_idempotency_key(conn):
+    add_column(conn, Order, 'idempotency_key')
+    create_index(conn, model_index(Order, 'uq_order_user_idempotency_key'))
+
+
+@migration(4, 'Menu search index')
+def menu_search_index(conn):
+    search.create_search_index(conn)
+    search.rebuild(conn)
+
+
+@migration(5, 'Admin dashboard rollups')
+def dashboard_rollups(conn):
+    create_table(conn, DashboardRollup)
+    rollups.rebuild(conn)
+
+
+def convert_to_numeric(conn, table, column, column_type, batch_size=5000):
+    """Change a float column to NUMERIC without rewriting the table under a lock
+
+    On PostgreSQL, ALTER COLUMN ... TYPE rewrites the whole table while
+    holding an ACCESS EXCLUSIVE lock. Instead a NUMERIC shadow column is
+    added, kept in step with writes by a trigger and backfilled batch_size
+    rows per transaction; a short final transaction then swaps it in by
+    dropping and renaming columns, which only changes the catalog. Safe to
+    rerun after a failure. Needs PostgreSQL 12+ and an integer `id` key.
+    """
+    found = conn.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"),
+        {'table': table, 'column': column}).scalar()
+    shadow, sync = f'{column}_numeric', f'{table}_{column}_numeric_sync'
+    if found == 'numeric':
+        conn.exec_driver_sql(f'DROP FUNCTION IF EXISTS "{sync}"()')
+        return
+    conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{shadow}" {column_type}')
+    conn.exec_driver_sql(
+        f'CREATE OR REPLACE FUNCTION "{sync}"() RETURNS trigger AS $$ BEGIN '
+        f'NEW."{shadow}" := round(NEW."{column}"::numeric, 2); RETURN NEW; END $$ LANGUAGE plpgsql')
+    has_trigger = conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname = :name"),
+                               {'name': sync}).first()
+    if not has_trigger:
+        conn.exec_driver_sql(f'CREATE TRIGGER "{sync}" BEFORE INSERT OR UPDATE ON "{table}" '
+                             f'FOR EACH ROW EXECUTE FUNCTION "{sync}"()')
+
+    # Rows written from here on are converted by the trigger
+    max_id = conn.exec_driver_sql(f'SELECT max(id) FROM "{table}"').scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        conn.execute(text(
+            f'UPDATE "{table}" SET "{shadow}" = round("{column}"::numeric, 2) '
+            f'WHERE id >= :start AND id < :end '
+            f'AND "{shadow}" IS DISTINCT FROM round("{column}"::numeric, 2)'),
+            {'start': start, 'end': start + batch_size})
+
+    # A validated CHECK lets SET NOT NULL skip its full-table scan under the lock
+    check = f'{shadow}_not_null'
+    has_check = conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :name"),
+                             {'name': check}).first()
+    if not has_check:
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD CONSTRAINT "{check}" '
+                             f'CHECK ("{shadow}" IS NOT NULL) NOT VALID')
+    conn.exec_driver_sql(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{check}"')
+
+    with transaction(conn):
+        # Give up rather than queue behind a long transaction, which would
+        # block every other query on the table while we wait
+        conn.exec_driver_sql("SET LOCAL lock_timeout = '5s'")
+        conn.exec_driver_sql(f'DROP TRIGGER "{sync}" ON "{table}"')
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" DROP COLUMN "{column}"')
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" RENAME COLUMN "{shadow}" TO "{column}"')
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ALTER COLUMN "{column}" SET NOT NULL')
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" DROP CONSTRAINT "{check}"')
+    conn.exec_driver_sql(f'DROP FUNCTION IF EXISTS "{sync}"()')
+
+
+@migration(6, 'Exact money columns', transactional=False)
+def money_columns(conn):
+    columns = [('menu_item', 'price', 'NUMERIC(10, 2)'), ('order', 'total_amount', 'NUMERIC(10, 2)'),
+               ('order_item', 'price', 'NUMERIC(10, 2)')]
+    for table, column, column_type in columns:
+        if conn.dialect.name == 'postgresql':
+            convert_to_numeric(conn, table, column, column_type)
+        else:
+            # SQLite columns take any type; round the stored floats to cents
+            conn.exec_driver_sql(f'UPDATE "{table}" SET "{column}" = ROUND("{column}", 2)')
+    with transaction(conn):
+        if conn.dialect.name == 'postgresql':
+            # A few rows per day and restaurant, and rebuilt right after
+            conn.exec_driver_sql('ALTER TABLE dashboard_rollup ALTER COLUMN amount TYPE NUMERIC(12, 2)')
+        # Recompute the rollups from the rounded order totals
+        rollups.rebuild(conn)
+
+
+@migration(7, 'Menu item lookup by restaurant and name', transactional=False)
+def menu_item_name_index(conn):
+    create_index(conn, model_index(MenuItem, 'ix_menu_item_restaurant_name'))
+
+
+@migration(8, 'Delivery fee stored per order')
+def order_delivery_fee(conn):
+    # Orders so far were all charged the old fixed 2.99. A constant default
+    # fills existing rows without a table rewrite on PostgreSQL 11+.
+    if 'delivery_fee' not in {c['name'] for c in inspect(conn).get_columns('order')}:
+        conn.exec_driver_sql('ALTER TABLE "order" ADD COLUMN delivery_fee NUMERIC(10, 2) '
+                             'NOT NULL DEFAULT 2.99')
+
+
+def init_migrations(app, seed=None):
+    """Register the `flask db` commands; `seed` fills an empty database after migrating"""
+
+    @app.cli.group('db')
+    def db_cli():
+        """Database schema migrations"""
+
+    @db_cli.command('init')
+    def init_command():
+        """Wait for the database, migrate and seed; run once per deploy"""
+        applied = setup(seed)
+        click.echo(f"Applied {len(applied)} migration(s); schema at version {current_version()}")
+
+    @db_cli.command('upgrade')
+    def upgrade_command():
+        """Apply pending migrations"""
+        with migration_lock():
+            applied = upgrade()
+        click.echo(f"Applied {len(applied)} migration(s); schema at version {current_version()}")
+
+    @db_cli.command('current')
+    def current_command():
+        """Show the applied and latest schema versions"""
+        click.echo(f"current: {current_version()}  head: {head_version()}")
@@ -1,9 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hasher
+from routing import RoutingSession
 from datetime import datetime
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+ORDER_STATUSES = ['pending', 'confirmed', 'preparing', 'out_for_delivery', 'delivered', 'cancelled']
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,10 +21,13 @@ class User(UserMixin, db.Model):
     cart_items = db.relationship('CartItem', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
 
 class Restaurant(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -35,12 +41,34 @@ class Restaurant(db.Model):
     
     # Relationships
     menu_items = db.relationship('MenuItem', backref='restaurant', lazy=True, cascade='all, delete-orphan')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'image_url': self.image_url,
+            'address': self.address,
+            'phone': self.phone,
+            'is_active': self.is_active,
+        }
 
 class MenuItem(db.Model):
+    __table_args__ = (
+        # Category scan on the restaurant page
+        db.Index('ix_menu_item_restaurant_category', 'restaurant_id', 'category'),
+        # Bulk import matches rows to existing items by restaurant and name
+        db.Index('ix_menu_item_restaurant_name', 'restaurant_id', 'name'),
+        # Available items per restaurant; partial so sold-out items cost nothing
+        db.Index('ix_menu_item_available_restaurant', 'restaurant_id',
+                 postgresql_where=db.text('is_available'),
+                 sqlite_where=db.text('is_available = 1')),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Numeric(10, 2), nullable=False)
     image_url = db.Column(db.String(255))
     category = db.Column(db.String(50))
     is_available = db.Column(db.Boolean, default=True)
@@ -50,8 +78,26 @@ class MenuItem(db.Model):
     # Relationships
     cart_items = db.relationship('CartItem', backref='menu_item', lazy=True, cascade='all, delete-orphan')
     order_items = db.relationship('OrderItem', backref='menu_item', lazy=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'price': float(self.price),
+            'image_url': self.image_url,
+            'category': self.category,
+            'is_available': self.is_available,
+            'restaurant_id': self.restaurant_id,
+        }
 
 class CartItem(db.Model):
+    __table_args__ = (
+        # One row per user and menu item; also serves lookups by user_id
+        db.Index('uq_cart_item_user_menu_item', 'user_id', 'menu_item_id', unique=True),
+        db.Index('ix_cart_item_menu_item_id', 'menu_item_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_item.id'), nullable=False)
@@ -59,22 +105,57 @@ class CartItem(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Order(db.Model):
+    __table_args__ = (
+        # Keyset pagination of the admin order list, optionally by status
+        db.Index('ix_order_created_at_id', 'created_at', 'id'),
+        db.Index('ix_order_status_created_at_id', 'status', 'created_at', 'id'),
+        # Order history per user
+        db.Index('ix_order_user_id_created_at', 'user_id', 'created_at'),
+        # Retried checkouts with the same key return the original order
+        db.Index('uq_order_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)
+    total_amount = db.Column(db.Numeric(10, 2), nullable=False)
+    # Charged on top of total_amount; kept per order so a new DELIVERY_FEE
+    # does not change past orders (2.99 for orders placed before migration 8)
+    delivery_fee = db.Column(db.Numeric(10, 2), nullable=False, server_default='2.99')
     status = db.Column(db.String(20), default='pending')  # pending, confirmed, preparing, out_for_delivery, delivered, cancelled
     delivery_address = db.Column(db.String(200))
     phone = db.Column(db.String(20))
+    idempotency_key = db.Column(db.String(64))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     order_items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
 
+    @property
+    def grand_total(self):
+        """Item total plus the delivery fee charged with the order"""
+        return self.total_amount + self.delivery_fee
+
 class OrderItem(db.Model):
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+        db.Index('ix_order_item_menu_item_id', 'menu_item_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_item.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)  # Price at time of order
+    price = db.Column(db.Numeric(10, 2), nullable=False)  # Price at time of order
+
+class DashboardRollup(db.Model):
+    """Running totals behind the admin dashboard, maintained by rollups.py
 
+    metric is 'status' (bucket: order status; count: orders, amount: order
+    totals), 'restaurant' or 'day' (bucket: restaurant id or YYYY-MM-DD;
+    count: items sold, amount: revenue, both excluding cancelled orders).
+    """
+    metric = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.String(40), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
@@ -0,0 +1,230 @@
+"""Request, SQL and cache metrics in Prometheus format, and a slow-request profiler
+
+    GET /metrics
+
+Every request records its latency (a histogram per endpoint), its status
+code, and the number and total time of the SQL statements it ran; the data
+and fragment caches count hits and misses. Needs the prometheus_client
+package (requirements-prod.txt); without it, or with METRICS_ENABLED=false,
+nothing is recorded and /metrics is not registered. Under gunicorn each
+worker records separately: with PROMETHEUS_MULTIPROC_DIR set (see
+gunicorn.conf.py) /metrics reports the sum over all workers.
+
+The profiler is off unless PROFILE_SLOW_REQUESTS_MS is set. A background
+thread then samples the stack of every in-flight request each
+PROFILE_INTERVAL_MS, and a request slower than the threshold has its
+samples written to PROFILE_DIR in the collapsed ("frame;frame;frame count")
+format read by flamegraph.pl and speedscope. It samples threads, so it is
+skipped in gevent workers.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import Response, abort, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # prometheus_client is optional, see requirements-prod.txt
+    prometheus_client = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+# Not recorded: static files and the scrapes themselves
+SKIPPED_ENDPOINTS = {'static', 'metrics'}
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        'foodapp_http_request_duration_seconds', 'Request latency',
+        ['endpoint', 'method'], buckets=LATENCY_BUCKETS)
+    REQUESTS = prometheus_client.Counter(
+        'foodapp_http_requests', 'Requests by status code', ['endpoint', 'method', 'status'])
+    SQL_STATEMENTS = prometheus_client.Counter(
+        'foodapp_sql_statements', 'SQL statements run', ['endpoint'])
+    SQL_TIME = prometheus_client.Counter(
+        'foodapp_sql_duration_seconds', 'Time spent in SQL statements', ['endpoint'])
+    SQL_LATENCY = prometheus_client.Histogram(
+        'foodapp_sql_statement_duration_seconds', 'SQL statement latency', buckets=SQL_BUCKETS)
+    CACHE_REQUESTS = prometheus_client.Counter(
+        'foodapp_cache_requests', 'Cache lookups', ['cache', 'name', 'result'])
+    SLOW_PROFILES = prometheus_client.Counter(
+        'foodapp_slow_request_profiles', 'Slow request profiles written', ['endpoint'])
+
+_local = threading.local()
+
+
+def _endpoint():
+    # Statements run outside a request (jobs, CLI) are grouped together
+    return getattr(_local, 'endpoint', None) or 'background'
+
+
+def _gevent_patched():
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    return sys.modules['gevent.monkey'].is_module_patched('threading')
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests from a background thread"""
+
+    def __init__(self, threshold_ms, interval_ms=5, directory='profiles', keep=100):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self.keep = keep
+        # thread id -> Counter of folded stacks
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_request(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slow-request-profiler',
+                                                daemon=True)
+                self._thread.start()
+
+    def finish_request(self, endpoint, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and elapsed >= self.threshold:
+            self._write(endpoint, elapsed, samples)
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, samples in active:
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[_fold(frame)] += 1
+
+    def _write(self, endpoint, elapsed, samples):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = (f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{endpoint}-{elapsed * 1000:.0f}ms'
+                    f'-{os.getpid()}.folded')
+            with open(os.path.join(self.directory, name), 'w') as f:
+                for stack, count in samples.most_common():
+                    f.write(f'{stack} {count}\n')
+            profiles = sorted(p for p in os.listdir(self.directory) if p.endswith('.folded'))
+            for old in profiles[:-self.keep]:
+                os.remove(os.path.join(self.directory, old))
+        except OSError as e:
+            print(f"Could not write slow request profile: {e}")
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Monitoring:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.profiler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        if self.enabled and prometheus_client is None:
+            print("prometheus_client is not installed, metrics are disabled")
+            self.enabled = False
+        threshold = app.config.get('PROFILE_SLOW_REQUESTS_MS')
+        if threshold is not None and _gevent_patched():
+            print("The slow request profiler does not support gevent workers, it is disabled")
+        elif threshold is not None:
+            self.profiler = SlowRequestProfiler(
+                threshold, app.config.get('PROFILE_INTERVAL_MS', 5),
+                app.config.get('PROFILE_DIR', 'profiles'), app.config.get('PROFILE_KEEP', 100))
+        app.extensions['monitoring'] = self
+        if not self.enabled and self.profiler is None:
+            return
+
+        if self.enabled:
+            if not event.contains(Engine, 'before_cursor_execute', _sql_start):
+                event.listen(Engine, 'before_cursor_execute', _sql_start)
+                event.listen(Engine, 'after_cursor_execute', _sql_end)
+            app.add_url_rule('/metrics', 'metrics', lambda: self.metrics_view(app))
+
+        @app.before_request
+        def _start_request_metrics():
+            if request.endpoint in SKIPPED_ENDPOINTS:
+                return
+            g.request_started = time.perf_counter()
+            _local.endpoint = request.endpoint or 'unmatched'
+            if self.profiler is not None:
+                self.profiler.start_request()
+
+        @app.after_request
+        def _request_status(response):
+            # Long-lived event streams would swamp the latency histograms
+            if response.mimetype == 'text/event-stream':
+                g.pop('request_started', None)
+            g.response_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def _record_request(exc):
+            started = g.pop('request_started', None)
+            endpoint = getattr(_local, 'endpoint', None)
+            _local.endpoint = None
+            if self.profiler is not None:
+                elapsed = time.perf_counter() - (started or time.perf_counter())
+                if self.profiler.finish_request(endpoint, elapsed) and self.enabled:
+                    SLOW_PROFILES.labels(endpoint).inc()
+            if started is None or not self.enabled:
+                return
+            status = 500 if exc is not None else g.get('response_status', 500)
+            REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+            REQUESTS.labels(endpoint, request.method, status).inc()
+
+    def cache_result(self, cache, name, hit):
+        """Count a cache lookup; name must come from a small fixed set"""
+        if self.enabled:
+            CACHE_REQUESTS.labels(cache, name, 'hit' if hit else 'miss').inc()
+
+    def metrics_view(self, app):
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return Response(prometheus_client.generate_latest(registry),
+                        mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def _sql_start(conn, cursor, statement, parameters, context, executemany):
+    context._monitoring_started = time.perf_counter()
+
+
+def _sql_end(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._monitoring_started
+    endpoint = _endpoint()
+    SQL_STATEMENTS.labels(endpoint).inc()
+    SQL_TIME.labels(endpoint).inc(elapsed)
+    SQL_LATENCY.observe(elapsed)
+
+
+monitoring = Monitoring()
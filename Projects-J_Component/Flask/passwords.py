@@ -0,0 +1,78 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    """No hashing slot freed up within PASSWORD_HASH_QUEUE_TIMEOUT"""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small bounded thread pool
+
+    scrypt and PBKDF2 release the GIL, so hashing on the pool leaves the
+    worker free to serve other threads (or greenlets, under gevent). At
+    most `max_concurrency` hashes run at once per process; callers wait up
+    to `queue_timeout` seconds for a slot and get HashingBusy instead of
+    piling up behind an attack.
+    """
+
+    def __init__(self, app=None):
+        self.method = 'scrypt'
+        self.max_concurrency = 2
+        self.queue_timeout = 2.0
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._prefix = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.max_concurrency = app.config.get('PASSWORD_HASH_CONCURRENCY', self.max_concurrency)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', self.queue_timeout)
+        app.extensions['password_hasher'] = self
+
+    def _pool(self):
+        # Created on first use so that forked workers each get their own threads
+        with self._lock:
+            if self._executor is None:
+                executor_class = ThreadPoolExecutor
+                monkey = sys.modules.get('gevent.monkey')
+                if monkey is not None and monkey.is_module_patched('threading'):
+                    # Patched threads are greenlets and would hash on the event
+                    # loop, stalling every request of the worker: use real threads
+                    from gevent.threadpool import ThreadPoolExecutor as executor_class
+                self._executor = executor_class(max_workers=self.max_concurrency,
+                                                thread_name_prefix='password-hash')
+                self._slots = threading.BoundedSemaphore(self.max_concurrency)
+            return self._executor, self._slots
+
+    def _run(self, func, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusy()
+        try:
+            return executor.submit(func, *args).result()
+        finally:
+            slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with different method or parameters"""
+        if self._prefix is None:
+            # werkzeug fills in default parameters (e.g. scrypt:32768:8:1),
+            # so derive the canonical prefix from a real hash once
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+hasher = PasswordHasher()
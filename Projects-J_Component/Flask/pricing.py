@@ -0,0 +1,54 @@
+"""Money arithmetic for carts and orders
+
+Prices and order totals are stored as NUMERIC(10, 2) and handled as Decimal,
+so a total is an exact sum of cents instead of a running float sum that picks
+up rounding drift. Cart and order totals are computed here once per request
+(in Python over rows that are already loaded, or with SUM() in the database),
+and the templates only format the results.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import func, select
+
+from models import db, OrderItem
+
+CENTS = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def money(value):
+    """value as a Decimal rounded to whole cents"""
+    if not isinstance(value, Decimal):
+        # str() first, so 0.1 becomes 0.10 and not 0.1000000000000000055...
+        value = Decimal(str(value))
+    return value.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def line_total(price, quantity):
+    return money(price) * quantity
+
+
+class CartTotals:
+    """Line totals, item count, subtotal and grand total of a loaded cart
+
+    `lines` maps cart item ids to their line totals, so templates look them
+    up instead of multiplying prices themselves.
+    """
+
+    def __init__(self, cart_items, delivery_fee=ZERO):
+        self.lines = {item.id: line_total(item.menu_item.price, item.quantity) for item in cart_items}
+        self.items = sum(item.quantity for item in cart_items)
+        self.subtotal = sum(self.lines.values(), ZERO)
+        self.delivery_fee = money(delivery_fee)
+        self.total = self.subtotal + self.delivery_fee
+
+
+def order_item_counts(order_ids):
+    """{order_id: number of items} in one aggregate query"""
+    if not order_ids:
+        return {}
+    return dict(db.session.execute(
+        select(OrderItem.order_id, func.sum(OrderItem.quantity))
+        .where(OrderItem.order_id.in_(order_ids))
+        .group_by(OrderItem.order_id)
+    ).all())
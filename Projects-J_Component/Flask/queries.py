@@ -0,0 +1,259 @@
+import base64
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, g, request
+from sqlalchemy import and_, event, literal, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, CartItem, MenuItem, Order, OrderItem
+
+
+# Eager-loading queries for the cart, checkout and order pages.
+# Each helper loads everything its template touches, so rendering does not
+# trigger one lazy load per row.
+def get_cart_items(user_id):
+    """Cart items with their menu item and restaurant in one query"""
+    return (CartItem.query
+            .filter_by(user_id=user_id)
+            .options(joinedload(CartItem.menu_item).joinedload(MenuItem.restaurant))
+            .order_by(CartItem.id)
+            .all())
+
+
+AddedToCart = namedtuple('AddedToCart', ['quantity', 'name', 'restaurant_id'])
+
+
+def add_to_cart_upsert(user_id, menu_item_id):
+    """Add one unit of a menu item to a user's cart in a single statement
+
+    INSERT ... SELECT ... ON CONFLICT DO UPDATE inserts the row or bumps the
+    quantity atomically, and the SELECT only yields a row while the menu item
+    is available. Returns an AddedToCart with the new quantity and the item's
+    name and restaurant (from RETURNING, so callers need no second query), or
+    None if the item does not exist or is unavailable. Relies on the unique
+    (user_id, menu_item_id) index from migration 2.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        return _add_to_cart_fallback(user_id, menu_item_id)
+
+    source = (select(literal(user_id), MenuItem.id, literal(1), literal(datetime.utcnow()))
+              .where(MenuItem.id == menu_item_id, MenuItem.is_available == True))
+    stmt = (insert(CartItem)
+            .from_select(['user_id', 'menu_item_id', 'quantity', 'created_at'], source))
+    name, restaurant_id = (select(column).where(MenuItem.id == menu_item_id).scalar_subquery()
+                           for column in (MenuItem.name, MenuItem.restaurant_id))
+    stmt = (stmt.on_conflict_do_update(index_elements=['user_id', 'menu_item_id'],
+                                       set_={'quantity': CartItem.quantity + 1})
+            .returning(CartItem.quantity, name, restaurant_id))
+    row = db.session.execute(stmt).first()
+    db.session.commit()
+    return AddedToCart(*row) if row is not None else None
+
+
+def _add_to_cart_fallback(user_id, menu_item_id):
+    # Read-then-write path for databases without ON CONFLICT
+    menu_item = db.session.get(MenuItem, menu_item_id)
+    if menu_item is None or not menu_item.is_available:
+        return None
+    cart_item = CartItem.query.filter_by(user_id=user_id, menu_item_id=menu_item_id).first()
+    if cart_item:
+        cart_item.quantity += 1
+    else:
+        cart_item = CartItem(user_id=user_id, menu_item_id=menu_item_id, quantity=1)
+        db.session.add(cart_item)
+    db.session.commit()
+    return AddedToCart(cart_item.quantity, menu_item.name, menu_item.restaurant_id)
+
+
+def get_user_orders(user_id, with_items=True):
+    """A user's orders, newest first, with their items (two queries)"""
+    query = Order.query.filter_by(user_id=user_id)
+    if with_items:
+        query = query.options(selectinload(Order.order_items))
+    return query.order_by(Order.created_at.desc()).all()
+
+
+def get_order_or_404(order_id):
+    """One order with its items, their menu items and the ordering user"""
+    order = (Order.query
+             .filter_by(id=order_id)
+             .options(joinedload(Order.user),
+                      selectinload(Order.order_items).joinedload(OrderItem.menu_item))
+             .first())
+    if order is None:
+        abort(404)
+    return order
+
+
+def get_recent_orders(limit=10):
+    """Latest orders with their users, for the admin dashboard"""
+    return (Order.query
+            .options(joinedload(Order.user))
+            .order_by(Order.created_at.desc())
+            .limit(limit)
+            .all())
+
+
+# Keyset pagination for the admin order list. Pages are addressed by the
+# (created_at, id) of the last row shown, so every page is an index range
+# scan of the same size no matter how deep into the history it is.
+def encode_order_cursor(order):
+    raw = f'{order.created_at.isoformat()}|{order.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_order_cursor(cursor):
+    """Return (created_at, id) for a cursor, or abort with 400 if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, order_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, UnicodeDecodeError):
+        abort(400)
+
+
+def order_filters(status=None, restaurant_id=None, date_from=None, date_to=None):
+    """WHERE clauses for the admin order filters; see get_admin_orders_page()"""
+    clauses = []
+    if status:
+        clauses.append(Order.status == status)
+    if date_from:
+        clauses.append(Order.created_at >= date_from)
+    if date_to:
+        clauses.append(Order.created_at < date_to)
+    if restaurant_id:
+        clauses.append(Order.order_items.any(
+            OrderItem.menu_item.has(MenuItem.restaurant_id == restaurant_id)))
+    return clauses
+
+
+def get_admin_orders_page(cursor=None, page_size=50, status=None, restaurant_id=None,
+                          date_from=None, date_to=None):
+    """One page of orders, newest first, and the cursor for the next page
+
+    date_from is inclusive and date_to exclusive. restaurant_id matches
+    orders that contain at least one item from that restaurant.
+    """
+    query = Order.query.options(joinedload(Order.user)).filter(
+        *order_filters(status, restaurant_id, date_from, date_to))
+    if cursor:
+        created_at, order_id = decode_order_cursor(cursor)
+        query = query.filter(or_(
+            Order.created_at < created_at,
+            and_(Order.created_at == created_at, Order.id < order_id),
+        ))
+
+    # Fetch one extra row to know whether there is a next page
+    orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(page_size + 1).all()
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_cursor = encode_order_cursor(orders[-1])
+    return orders, next_cursor
+
+
+# Query budget: counts SQL statements per request and complains when a
+# request goes over QUERY_BUDGET (or a per-endpoint QUERY_BUDGETS entry).
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+_local = threading.local()
+
+
+def _active_counters():
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    return _local.counters
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in _active_counters():
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+class query_budget:
+    """Context manager that fails if the block runs more than `limit` statements
+
+        with query_budget(3):
+            client.get('/cart')
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.counter = QueryCounter()
+
+    def __enter__(self):
+        _active_counters().append(self.counter)
+        return self.counter
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_counters().remove(self.counter)
+        if exc_type is None and self.counter.count > self.limit:
+            raise QueryBudgetExceeded(_budget_message(self.counter, self.limit, 'block'))
+        return False
+
+
+def _budget_message(counter, limit, where):
+    statements = '\n'.join(f'  {s}' for s in counter.statements)
+    return f'{where} ran {counter.count} SQL statements (budget {limit}):\n{statements}'
+
+
+def init_query_budget(app):
+    """Count statements per request when QUERY_BUDGET or QUERY_BUDGETS is set
+
+    With QUERY_BUDGET_ASSERT enabled (meant for tests) an over-budget request
+    raises QueryBudgetExceeded; otherwise a warning is printed. The settings
+    are read per request, so tests can switch them on after import.
+    """
+
+    def budget_for(endpoint):
+        budgets = app.config.get('QUERY_BUDGETS') or {}
+        return budgets.get(endpoint, app.config.get('QUERY_BUDGET'))
+
+    @app.before_request
+    def _start_query_count():
+        if app.config.get('QUERY_BUDGET') is None and not app.config.get('QUERY_BUDGETS'):
+            return
+        g.query_counter = QueryCounter()
+        _active_counters().append(g.query_counter)
+
+    @app.after_request
+    def _check_query_budget(response):
+        counter = g.pop('query_counter', None)
+        if counter is None:
+            return response
+        _active_counters().remove(counter)
+        response.headers['X-Query-Count'] = str(counter.count)
+        endpoint = request.endpoint or request.path
+        limit = budget_for(endpoint)
+        if limit is not None and counter.count > limit:
+            message = _budget_message(counter, limit, endpoint)
+            if app.config.get('QUERY_BUDGET_ASSERT'):
+                raise QueryBudgetExceeded(message)
+            print(f"Query budget exceeded: {message}")
+        return response
+
+    @app.teardown_request
+    def _discard_query_count(exc):
+        # after_request is skipped when a view raises
+        counter = g.pop('query_counter', None)
+        if counter is not None and counter in _active_counters():
+            _active_counters().remove(counter)
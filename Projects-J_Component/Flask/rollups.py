@@ -0,0 +1,175 @@
+"""Incrementally maintained admin dashboard metrics
+
+Checkout and order status changes add their deltas to the dashboard_rollup
+table in the same transaction, so the dashboard reads a handful of small
+rows instead of aggregating Order and OrderItem. The upsert is the last
+statement before the commit, which keeps the row locks on the shared
+counters as short as possible. `flask metrics rebuild` recomputes
+everything from the order tables.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import Date, String, cast, delete, func, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, DashboardRollup, MenuItem, Order, OrderItem, ORDER_STATUSES
+from pricing import ZERO
+
+REVENUE_EXCLUDED_STATUS = 'cancelled'
+
+
+def _day(value):
+    return value.strftime('%Y-%m-%d')
+
+
+def _apply(deltas):
+    """Add {(metric, bucket): [count, amount]} to the rollup rows"""
+    rows = [{'metric': metric, 'bucket': bucket, 'count': count, 'amount': amount}
+            # Fixed order so concurrent transactions lock the rows consistently
+            for (metric, bucket), (count, amount) in sorted(deltas.items())
+            if count or amount]
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(DashboardRollup).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['metric', 'bucket'],
+            set_={'count': DashboardRollup.count + stmt.excluded['count'],
+                  'amount': DashboardRollup.amount + stmt.excluded.amount})
+        db.session.execute(stmt)
+        return
+    for row in rows:
+        rollup = db.session.get(DashboardRollup, (row['metric'], row['bucket']))
+        if rollup is None:
+            db.session.add(DashboardRollup(**row))
+        else:
+            rollup.count += row['count']
+            rollup.amount += row['amount']
+    db.session.flush()
+
+
+def _add_sales(deltas, order, lines, sign):
+    for restaurant_id, quantity, revenue in lines:
+        for key in (('restaurant', str(restaurant_id)), ('day', _day(order.created_at))):
+            deltas[key][0] += sign * quantity
+            deltas[key][1] += sign * revenue
+
+
+def record_order(order, lines):
+    """Count a newly placed order; lines are (restaurant_id, quantity, revenue)
+
+    Call after the order is flushed and before the checkout commits.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    deltas[('status', order.status)] = [1, order.total_amount]
+    if order.status != REVENUE_EXCLUDED_STATUS:
+        _add_sales(deltas, order, lines, 1)
+    _apply(deltas)
+
+
+def record_status_change(order, old_status):
+    """Move an order between status buckets; call before committing the change
+
+    Cancelling an order (or reinstating one) also takes its items out of (or
+    puts them back into) the revenue and items-sold totals.
+    """
+    if order.status == old_status:
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    deltas[('status', old_status)] = [-1, -order.total_amount]
+    deltas[('status', order.status)] = [1, order.total_amount]
+    if (old_status == REVENUE_EXCLUDED_STATUS) != (order.status == REVENUE_EXCLUDED_STATUS):
+        sign = -1 if order.status == REVENUE_EXCLUDED_STATUS else 1
+        _add_sales(deltas, order, _order_lines(order.id), sign)
+    _apply(deltas)
+
+
+def _order_lines(order_id):
+    return db.session.execute(
+        select(MenuItem.restaurant_id, func.sum(OrderItem.quantity),
+               func.sum(OrderItem.quantity * OrderItem.price))
+        .join(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+        .where(OrderItem.order_id == order_id)
+        .group_by(MenuItem.restaurant_id)
+    ).all()
+
+
+def rebuild(conn):
+    """Recompute every rollup row from the order tables"""
+    if conn.dialect.name == 'postgresql':
+        # Checkouts wait for the rebuild instead of adding deltas it would overwrite
+        conn.execute(text('LOCK TABLE dashboard_rollup IN EXCLUSIVE MODE'))
+    if conn.dialect.name == 'sqlite':
+        day = func.date(Order.created_at)
+    else:
+        day = cast(cast(Order.created_at, Date), String)
+    columns = ['metric', 'bucket', 'count', 'amount']
+    counted = Order.status != REVENUE_EXCLUDED_STATUS
+    quantity = func.sum(OrderItem.quantity)
+    revenue = func.sum(OrderItem.quantity * OrderItem.price)
+
+    conn.execute(delete(DashboardRollup))
+    conn.execute(DashboardRollup.__table__.insert().from_select(columns, select(
+        literal('status'), Order.status, func.count(), func.sum(Order.total_amount)
+    ).where(Order.status.isnot(None)).group_by(Order.status)))
+    conn.execute(DashboardRollup.__table__.insert().from_select(columns, select(
+        literal('restaurant'), cast(MenuItem.restaurant_id, String), quantity, revenue
+    ).select_from(OrderItem)
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+        .where(counted).group_by(MenuItem.restaurant_id)))
+    conn.execute(DashboardRollup.__table__.insert().from_select(columns, select(
+        literal('day'), day, quantity, revenue
+    ).select_from(OrderItem)
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(counted).group_by(day)))
+
+
+def dashboard_metrics(days=14):
+    """Dashboard totals in a single query over the rollup table"""
+    since = _day(datetime.utcnow() - timedelta(days=days - 1))
+    rows = db.session.execute(
+        select(DashboardRollup)
+        .where((DashboardRollup.metric != 'day') | (DashboardRollup.bucket >= since))
+    ).scalars().all()
+
+    by_status = {status: {'status': status, 'orders': 0, 'amount': ZERO} for status in ORDER_STATUSES}
+    by_day = {}
+    restaurants = []
+    for row in rows:
+        if row.metric == 'status':
+            by_status[row.bucket] = {'status': row.bucket, 'orders': row.count, 'amount': row.amount}
+        elif row.metric == 'restaurant':
+            restaurants.append({'restaurant_id': int(row.bucket), 'items': row.count,
+                                'revenue': row.amount})
+        elif row.metric == 'day':
+            by_day[row.bucket] = {'day': row.bucket, 'items': row.count, 'revenue': row.amount}
+
+    today = datetime.utcnow()
+    return {
+        'orders_by_status': list(by_status.values()),
+        'total_orders': sum(entry['orders'] for entry in by_status.values()),
+        'revenue_by_restaurant': sorted(restaurants, key=lambda entry: -entry['revenue']),
+        'total_revenue': sum((entry['revenue'] for entry in restaurants), ZERO),
+        'items_per_day': [by_day.get(day, {'day': day, 'items': 0, 'revenue': ZERO})
+                          for day in (_day(today - timedelta(days=n)) for n in range(days - 1, -1, -1))],
+    }
+
+
+def init_rollups(app):
+    """Register the `flask metrics` commands"""
+
+    @app.cli.group('metrics')
+    def metrics_cli():
+        """Admin dashboard rollups"""
+
+    @metrics_cli.command('rebuild')
+    def rebuild_command():
+        """Recompute the dashboard rollups from the order tables"""
+        with db.engine.begin() as conn:
+            rebuild(conn)
+        click.echo('Dashboard rollups rebuilt')
@@ -0,0 +1,153 @@
+"""Read/write routing between the primary database and read replicas
+
+Replicas are the SQLALCHEMY_BINDS keys starting with `replica`, set from
+DATABASE_REPLICA_URLS. Views decorated with @replica_reads run their SELECTs
+on one healthy replica, chosen per request; everything else uses the
+primary:
+
+- writes (flushes and INSERT / UPDATE / DELETE statements), and every
+  query after the first write of a request
+- SELECT ... FOR UPDATE, and blocks run under `with primary():`
+- a user's requests for READ_YOUR_WRITES_SECONDS after a request of theirs
+  wrote something, so e.g. the order page after checkout sees the order
+  even while the replicas lag behind
+
+A replica that fails to connect is skipped for REPLICA_RETRY_INTERVAL
+seconds, and a view whose replica query fails is run again on the primary,
+so a replica outage costs at most one retried request per worker.
+"""
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import CompoundSelect, Select, UpdateBase, event
+from sqlalchemy.exc import DBAPIError
+
+
+def _is_read(clause):
+    return isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """db.session class that sends reads to the request's replica, if any"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True
+            elif _is_read(clause):
+                replica = _replica_engine(self._db)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _replica_engine(db):
+    key = g.get('read_replica')
+    if key is None or g.get('db_wrote'):
+        return None
+    return db.engines[key]
+
+
+def read_connection():
+    """Connection for raw read-only SQL: the request's replica, else the primary"""
+    db = current_app.extensions['sqlalchemy']
+    session = db.session()
+    replica = _replica_engine(db)
+    if replica is None:
+        return session.connection()
+    return session.connection(bind_arguments={'bind': replica})
+
+
+@contextmanager
+def primary():
+    """Run the block's queries on the primary, e.g. to fill a shared cache"""
+    replica = g.pop('read_replica', None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.read_replica = replica
+
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.replicas = []
+        self.retry_interval = 30
+        self.pin_seconds = 5
+        self._down_until = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.replicas = sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+                               if key.startswith('replica'))
+        self.retry_interval = app.config.get('REPLICA_RETRY_INTERVAL', self.retry_interval)
+        self.pin_seconds = app.config.get('READ_YOUR_WRITES_SECONDS', self.pin_seconds)
+        app.extensions['replica_router'] = self
+        if not self.replicas:
+            return
+
+        with app.app_context():
+            engines = app.extensions['sqlalchemy'].engines
+            for key in self.replicas:
+                event.listen(engines[key], 'handle_error', self._error_listener(key))
+
+        @app.after_request
+        def _pin_to_primary(response):
+            if g.get('db_wrote'):
+                session['primary_until'] = time.time() + self.pin_seconds
+            return response
+
+    def _error_listener(self, key):
+        def on_error(context):
+            if has_app_context():
+                g.replica_failed = True
+            # No connection means connecting failed; skip the replica for a while
+            if context.is_disconnect or context.connection is None:
+                if self._down_until.get(key, 0) < time.monotonic():
+                    print(f"Read replica {key} unavailable, reading from the primary: "
+                          f"{context.original_exception}")
+                self._down_until[key] = time.monotonic() + self.retry_interval
+        return on_error
+
+    def choose(self):
+        """A healthy replica for this request, or None for the primary"""
+        if not self.replicas or session.get('primary_until', 0) > time.time():
+            return None
+        now = time.monotonic()
+        healthy = [key for key in self.replicas if self._down_until.get(key, 0) < now]
+        return random.choice(healthy) if healthy else None
+
+
+def replica_reads(view):
+    """Let a read-only view query a read replica
+
+    The view must not write: a write would succeed on the primary, but its
+    queries before the write would have read from the replica.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = current_app.extensions['replica_router'].choose()
+        if key is None:
+            return view(*args, **kwargs)
+        g.read_replica = key
+        try:
+            return view(*args, **kwargs)
+        except DBAPIError:
+            if not g.pop('replica_failed', False):
+                raise
+            current_app.extensions['sqlalchemy'].session.rollback()
+            g.pop('read_replica', None)
+            return view(*args, **kwargs)
+        finally:
+            g.pop('read_replica', None)
+
+    return wrapper
+
+
+replica_router = ReplicaRouter()
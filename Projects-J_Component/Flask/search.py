@@ -0,0 +1,215 @@
+"""Full-text, faceted menu search
+
+Menu items are denormalised together with their restaurant's name into a
+menu_search table (created by migration 4):
+
+- PostgreSQL: a plain table with a weighted, generated tsvector column and a
+  GIN index; queries use to_tsquery prefix matching ranked by ts_rank.
+- SQLite: an FTS5 virtual table whose rowid is the menu item id; queries use
+  MATCH ranked by bm25.
+
+The index is refreshed in the same transaction as any ORM write to MenuItem
+or Restaurant. Bulk Core inserts bypass the ORM and must call
+reindex_restaurant() themselves; `flask search rebuild` rebuilds everything.
+"""
+import re
+
+import click
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.orm import Session
+
+from models import db, Restaurant, MenuItem
+from routing import read_connection
+
+DEFAULT_PRICE_BUCKETS = (10, 20, 30)
+
+_INDEX_COLUMNS = ('restaurant_id, restaurant_name, restaurant_active, name, description, '
+                  'category, price, is_available')
+_SOURCE_SELECT = (
+    'SELECT m.id, r.id, r.name, r.is_active, m.name, m.description, m.category, m.price, '
+    'm.is_available FROM menu_item m JOIN restaurant r ON r.id = m.restaurant_id')
+
+
+# Schema, used by migration 4
+def create_search_index(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS menu_search ("
+            " menu_item_id INTEGER PRIMARY KEY REFERENCES menu_item(id) ON DELETE CASCADE,"
+            " restaurant_id INTEGER NOT NULL, restaurant_name VARCHAR(100),"
+            " restaurant_active BOOLEAN, name VARCHAR(100), description TEXT,"
+            " category VARCHAR(50), price DOUBLE PRECISION, is_available BOOLEAN,"
+            " document tsvector GENERATED ALWAYS AS ("
+            "  setweight(to_tsvector('english', coalesce(name, '')), 'A') ||"
+            "  setweight(to_tsvector('english', coalesce(category, '') || ' ' || coalesce(restaurant_name, '')), 'B') ||"
+            "  setweight(to_tsvector('english', coalesce(description, '')), 'C')) STORED)")
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_menu_search_document ON menu_search USING GIN (document)")
+    else:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS menu_search USING fts5("
+            " name, category, restaurant_name, description,"
+            " restaurant_id UNINDEXED, restaurant_active UNINDEXED, price UNINDEXED,"
+            " is_available UNINDEXED, tokenize='porter unicode61')")
+
+
+def _key(conn):
+    return 'menu_item_id' if conn.dialect.name == 'postgresql' else 'rowid'
+
+
+def _insert(conn, where, params, binds=()):
+    conn.execute(text(f'INSERT INTO menu_search ({_key(conn)}, {_INDEX_COLUMNS}) '
+                      f'{_SOURCE_SELECT} WHERE {where}').bindparams(*binds), params)
+
+
+def _refresh(conn, where, params, binds=()):
+    """Re-copy the menu items matching `where` (on alias m) into the index"""
+    conn.execute(text(f'DELETE FROM menu_search WHERE {_key(conn)} IN '
+                      f'(SELECT m.id FROM menu_item m WHERE {where})').bindparams(*binds), params)
+    _insert(conn, where, params, binds)
+
+
+def _remove(conn, menu_item_ids):
+    key = _key(conn)
+    conn.execute(text(f'DELETE FROM menu_search WHERE {key} IN :ids')
+                 .bindparams(bindparam('ids', expanding=True)), {'ids': list(menu_item_ids)})
+
+
+def rebuild(conn):
+    """Rebuild the whole index from menu_item and restaurant"""
+    conn.exec_driver_sql('DELETE FROM menu_search')
+    _insert(conn, '1 = 1', {})
+
+
+def reindex_restaurant(conn, restaurant_id):
+    _refresh(conn, 'm.restaurant_id = :restaurant_id', {'restaurant_id': restaurant_id})
+
+
+# Keep the index in step with ORM writes, inside the same transaction
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault('search_reindex', {'items': set(), 'restaurants': set(), 'removed': set()})
+    for obj in session.new | session.dirty:
+        if isinstance(obj, MenuItem):
+            pending['items'].add(obj.id)
+        elif isinstance(obj, Restaurant):
+            pending['restaurants'].add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, MenuItem):
+            pending['removed'].add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _apply_changes(session, flush_context):
+    pending = session.info.pop('search_reindex', None)
+    if not pending or not any(pending.values()):
+        return
+    conn = session.connection()
+    if pending['removed']:
+        _remove(conn, pending['removed'])
+    if pending['items']:
+        _refresh(conn, 'm.id IN :ids', {'ids': list(pending['items'])},
+                 [bindparam('ids', expanding=True)])
+    for restaurant_id in pending['restaurants']:
+        reindex_restaurant(conn, restaurant_id)
+
+
+# Queries
+def _tokens(query):
+    return re.findall(r'\w+', query.lower())[:8]
+
+
+def _price_bucket_sql(buckets):
+    cases = []
+    low = 0
+    for high in buckets:
+        cases.append(f"WHEN price < {float(high)} THEN '{low}-{high}'")
+        low = high
+    return f"CASE {' '.join(cases)} ELSE '{low}+' END"
+
+
+def search_menu(query, category=None, restaurant_id=None, price_bucket=None, limit=20,
+                price_buckets=DEFAULT_PRICE_BUCKETS):
+    """Ranked available menu items matching `query`, plus facet counts
+
+    Returns {'results': [...], 'facets': {'category': [...], 'restaurant':
+    [...], 'price': [...]}}. Facets count every match under the current
+    filters, not just the returned page. Two statements in total.
+    """
+    tokens = _tokens(query or '')
+    empty = {'results': [], 'facets': {'category': [], 'restaurant': [], 'price': []}}
+    if not tokens:
+        return empty
+
+    conn = read_connection()
+    bucket = _price_bucket_sql(price_buckets)
+    params = {'limit': limit}
+    if conn.dialect.name == 'postgresql':
+        params['q'] = ' & '.join(f'{t}:*' for t in tokens)
+        source = ("SELECT menu_item_id AS id, restaurant_id, restaurant_name, name, description, "
+                  "category, price, ts_rank(document, q) AS rank "
+                  "FROM menu_search, to_tsquery('english', :q) q "
+                  "WHERE document @@ q AND is_available AND restaurant_active")
+        order = 'rank DESC, id'
+    else:
+        params['q'] = ' '.join(f'"{t}"*' for t in tokens)
+        source = ("SELECT rowid AS id, restaurant_id, restaurant_name, name, description, "
+                  "category, price, bm25(menu_search, 10.0, 5.0, 5.0, 1.0) AS rank "
+                  "FROM menu_search WHERE menu_search MATCH :q "
+                  "AND is_available = 1 AND restaurant_active = 1")
+        order = 'rank, id'
+
+    filters = []
+    if category:
+        filters.append('category = :category')
+        params['category'] = category
+    if restaurant_id:
+        filters.append('restaurant_id = :restaurant_id')
+        params['restaurant_id'] = restaurant_id
+    if price_bucket:
+        filters.append(f'{bucket} = :price_bucket')
+        params['price_bucket'] = price_bucket
+    matches = f"WITH matches AS ({source}) SELECT * FROM matches"
+    if filters:
+        matches += ' WHERE ' + ' AND '.join(filters)
+
+    results = conn.execute(text(f'{matches} ORDER BY {order} LIMIT :limit'), params).mappings().all()
+    facet_rows = conn.execute(text(
+        f"WITH filtered AS ({matches}) "
+        "SELECT 'category' AS facet, category AS value, NULL AS label, COUNT(*) AS count "
+        "FROM filtered WHERE category IS NOT NULL GROUP BY category "
+        "UNION ALL "
+        "SELECT 'restaurant', CAST(restaurant_id AS VARCHAR(20)), restaurant_name, COUNT(*) "
+        "FROM filtered GROUP BY restaurant_id, restaurant_name "
+        "UNION ALL "
+        f"SELECT 'price', {bucket}, NULL, COUNT(*) FROM filtered GROUP BY {bucket}"), params).all()
+
+    facets = {'category': [], 'restaurant': [], 'price': []}
+    for facet, value, label, count in facet_rows:
+        entry = {'value': value, 'count': count}
+        if facet == 'restaurant':
+            entry = {'value': int(value), 'label': label, 'count': count}
+        facets[facet].append(entry)
+    for entries in facets.values():
+        entries.sort(key=lambda e: (-e['count'], str(e['value'])))
+    return {
+        'results': [{key: row[key] for key in ('id', 'restaurant_id', 'restaurant_name', 'name',
+                                               'description', 'category', 'price')}
+                    for row in results],
+        'facets': facets,
+    }
+
+
+def init_search(app):
+    """Register the `flask search` commands"""
+
+    @app.cli.group('search')
+    def search_cli():
+        """Menu search index"""
+
+    @search_cli.command('rebuild')
+    def rebuild_command():
+        """Rebuild the menu search index from scratch"""
+        with db.engine.begin() as conn:
+            rebuild(conn)
+        click.echo('Search index rebuilt')
@@ -0,0 +1,115 @@
+import secrets
+
+from flask import session
+from flask_login import user_logged_in, user_logged_out
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+from itsdangerous import BadSignature, Signer
+
+from cache import cache, redis
+
+
+class RedisSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, new=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+        self.old_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh session id (prevents session fixation)"""
+        if self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class RedisSessionInterface(SecureCookieSessionInterface):
+    """Server-side sessions stored in Redis, shared by all workers
+
+    The cookie only carries a signed session id. While Redis is unavailable
+    requests fall back to Flask's signed-cookie sessions; switching between
+    the two logs the user out once, since neither can read the other's cookie.
+    """
+
+    redis_salt = 'redis-session'
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.redis_salt)
+
+    def _key(self, app, sid):
+        return cache.key(app.config.get('SESSION_KEY_PREFIX', 'session'), sid)
+
+    def open_session(self, app, request):
+        client = cache.redis
+        if client is None:
+            return super().open_session(app, request)
+        value = request.cookies.get(self.get_cookie_name(app))
+        if value:
+            try:
+                sid = self._signer(app).unsign(value).decode()
+                data = client.get(self._key(app, sid))
+                if data is not None:
+                    return RedisSession(self.serializer.loads(data.decode()), sid=sid)
+            except BadSignature:
+                pass
+            except redis.RedisError as e:
+                cache.redis_failed(e)
+                return super().open_session(app, request)
+        return RedisSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, RedisSession):
+            return super().save_session(app, session, response)
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        client = cache.redis
+        try:
+            if session.old_sid and client is not None:
+                client.delete(self._key(app, session.old_sid))
+            if not session:
+                # Emptied (e.g. on logout): drop the server-side copy too
+                if session.modified:
+                    if client is not None:
+                        client.delete(self._key(app, session.sid))
+                    response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                           samesite=samesite, httponly=httponly)
+                return
+            if session.modified and client is not None:
+                lifetime = int(app.permanent_session_lifetime.total_seconds())
+                client.set(self._key(app, session.sid), self.serializer.dumps(dict(session)), ex=lifetime)
+        except redis.RedisError as e:
+            cache.redis_failed(e)
+            return
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+
+
+def init_sessions(app):
+    """Use Redis-backed sessions when SESSION_USE_REDIS is set"""
+    if app.config.get('SESSION_USE_REDIS') and redis is not None:
+        app.session_interface = RedisSessionInterface()
+
+        @user_logged_in.connect_via(app)
+        @user_logged_out.connect_via(app)
+        def _regenerate_session(sender, user, **extra):
+            if isinstance(session._get_current_object(), RedisSession):
+                session.regenerate()
@@ -64,3 +64,34 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+// Live order status updates (Server-Sent Events)
+document.addEventListener('DOMContentLoaded', function() {
+    const container = document.querySelector('[data-order-events]');
+    if (!container || !window.EventSource) {
+        return;
+    }
+    // The browser reconnects on its own and sends Last-Event-ID to resume
+    const source = new EventSource(container.dataset.orderEvents);
+    
+    source.addEventListener('order_status', function(e) {
+        const order = JSON.parse(e.data);
+        document.querySelectorAll('[data-order-status="' + order.order_id + '"]').forEach(function(element) {
+            if (element.tagName === 'SELECT') {
+                element.value = order.status;
+            } else {
+                element.className = 'order-status status-' + order.status;
+                element.textContent = order.status.replace(/_/g, ' ').replace(/\b\w/g, function(c) {
+                    return c.toUpperCase();
+                });
+            }
+        });
+    });
+    
+    source.addEventListener('order_created', function() {
+        const notice = document.querySelector('.new-orders-notice');
+        if (notice) {
+            notice.hidden = false;
+        }
+    });
+});
+
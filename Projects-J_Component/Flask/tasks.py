@@ -0,0 +1,43 @@
+"""Background jobs run after checkout and order status changes
+
+Enqueued by the request path with .delay(); run by `flask jobs work`.
+"""
+from flask import current_app
+from werkzeug.utils import import_string
+
+from jobs import jobs
+from models import db, Order, User
+
+
+def send_notification(user, subject, body):
+    """Deliver a customer notification through NOTIFICATION_SENDER
+
+    NOTIFICATION_SENDER is the import path of a `sender(user, subject, body)`
+    callable, e.g. 'mail:send_order_mail'; an exception it raises fails the
+    job, which is then retried. Without one, notifications are only logged.
+    """
+    sender = current_app.config.get('NOTIFICATION_SENDER')
+    if sender:
+        import_string(sender)(user, subject, body)
+        return
+    current_app.logger.info('Notification to %s: %s - %s', user.email, subject, body)
+
+
+@jobs.task(queue='notifications')
+def notify_order_placed(order_id):
+    order = db.session.get(Order, order_id)
+    if order is None:
+        return
+    user = db.session.get(User, order.user_id)
+    send_notification(user, f'Order #{order.id} received',
+                      f'We have received your order of ${order.total_amount:.2f}.')
+
+
+@jobs.task(queue='notifications')
+def notify_order_status(order_id, status):
+    order = db.session.get(Order, order_id)
+    if order is None:
+        return
+    user = db.session.get(User, order.user_id)
+    send_notification(user, f'Order #{order.id} update',
+                      f"Your order is now {status.replace('_', ' ')}.")
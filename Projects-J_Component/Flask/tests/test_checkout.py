@@ -0,0 +1,81 @@
+"""place_order and order_item_counts against a real (SQLite) database"""
+import os
+from decimal import Decimal
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # Read by config.py when app is first imported
+    os.environ['DATABASE_URL'] = 'sqlite:///' + str(tmp_path_factory.mktemp('db') / 'checkout.db')
+    os.environ.setdefault('JOB_BACKEND', 'memory')
+    from app import app, seed_database
+    from migrations import setup
+    with app.app_context():
+        setup(seed_database)
+    return app
+
+
+@pytest.fixture
+def cart(app):
+    """A user whose cart holds 3 x 0.10 and 7 x 0.20, prices whose float sums drift"""
+    from models import db, CartItem, MenuItem, User
+    with app.app_context():
+        user = User(username=f'checkout{User.query.count()}', email=f'checkout{User.query.count()}@example.com')
+        user.set_password('secret1')
+        db.session.add(user)
+        first, second = MenuItem.query.filter_by(is_available=True).order_by(MenuItem.id).limit(2).all()
+        first.price, second.price = Decimal('0.10'), Decimal('0.20')
+        db.session.flush()
+        db.session.add_all([CartItem(user_id=user.id, menu_item_id=first.id, quantity=3),
+                            CartItem(user_id=user.id, menu_item_id=second.id, quantity=7)])
+        db.session.commit()
+        yield user.id
+        db.session.remove()
+
+
+def test_place_order_stores_exact_decimal_totals(app, cart):
+    from checkout import place_order
+    from models import db, Order, OrderItem
+    from pricing import order_item_counts
+
+    app.config['DELIVERY_FEE'] = Decimal('4.50')
+    with app.app_context():
+        order, created = place_order(cart, '1 Test Street', '555-0100', 'key-1')
+        order_id = order.id
+        db.session.remove()
+
+        order = db.session.get(Order, order_id)
+        items = OrderItem.query.filter_by(order_id=order_id).all()
+        assert created
+        assert isinstance(order.total_amount, Decimal)
+        assert all(isinstance(item.price, Decimal) for item in items)
+        assert order.total_amount == sum((item.price * item.quantity for item in items), Decimal('0'))
+        assert order.total_amount == Decimal('1.70')
+        assert order.delivery_fee == Decimal('4.50')
+        assert order.grand_total == Decimal('6.20')
+        assert order_item_counts([order_id]) == {order_id: 10}
+        assert order_item_counts([]) == {}
+
+
+def test_place_order_keeps_the_fee_it_charged(app, cart):
+    from checkout import place_order
+    from models import db, Order
+
+    app.config['DELIVERY_FEE'] = Decimal('2.99')
+    with app.app_context():
+        order_id = place_order(cart, '1 Test Street', '555-0100')[0].id
+        app.config['DELIVERY_FEE'] = Decimal('9.99')
+        db.session.remove()
+        assert db.session.get(Order, order_id).delivery_fee == Decimal('2.99')
+
+
+def test_place_order_is_idempotent(app, cart):
+    from checkout import place_order
+
+    with app.app_context():
+        order, created = place_order(cart, '1 Test Street', '555-0100', 'key-2')
+        again, created_again = place_order(cart, '1 Test Street', '555-0100', 'key-2')
+        assert created and not created_again
+        assert again.id == order.id
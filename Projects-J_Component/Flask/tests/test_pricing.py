@@ -0,0 +1,111 @@
+"""Decimal totals in pricing.py against the float arithmetic they replaced
+
+The random carts are seeded, so a failure reproduces with the same seed.
+"""
+import random
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from pricing import CartTotals, ZERO, line_total, money
+
+SEEDS = range(20)
+CARTS_PER_SEED = 100
+
+
+def random_cart(rng):
+    """Cart items shaped like CartItem rows: cent prices, small quantities"""
+    return [SimpleNamespace(id=n, quantity=rng.randint(1, 20),
+                            menu_item=SimpleNamespace(price=Decimal(rng.randint(1, 99999)) / 100))
+            for n in range(rng.randint(0, 30))]
+
+
+def float_subtotal(cart_items):
+    # The old cart_total(): a running float sum of price * quantity
+    return sum(float(item.menu_item.price) * item.quantity for item in cart_items)
+
+
+def exact_cents(cart_items):
+    return sum(int(item.menu_item.price * 100) * item.quantity for item in cart_items)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_subtotal_is_exact_and_matches_rounded_float_sum(seed):
+    rng = random.Random(seed)
+    for _ in range(CARTS_PER_SEED):
+        cart_items = random_cart(rng)
+        totals = CartTotals(cart_items)
+        assert totals.subtotal == Decimal(exact_cents(cart_items)) / 100
+        assert totals.subtotal == money(float_subtotal(cart_items))
+        assert totals.subtotal.as_tuple().exponent == -2
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_cart_totals_lines_items_and_total(seed):
+    rng = random.Random(seed)
+    for _ in range(CARTS_PER_SEED):
+        cart_items = random_cart(rng)
+        fee = Decimal(rng.randint(0, 999)) / 100
+        totals = CartTotals(cart_items, fee)
+        assert set(totals.lines) == {item.id for item in cart_items}
+        assert totals.items == sum(item.quantity for item in cart_items)
+        assert totals.subtotal == sum(totals.lines.values(), ZERO)
+        assert totals.delivery_fee == fee
+        assert totals.total == totals.subtotal + fee
+        assert money(float_subtotal(cart_items) + float(fee)) == totals.total
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_line_total_matches_float_product(seed):
+    rng = random.Random(seed)
+    for _ in range(CARTS_PER_SEED):
+        price, quantity = Decimal(rng.randint(0, 99999)) / 100, rng.randint(1, 1000)
+        total = line_total(price, quantity)
+        assert total == price * quantity
+        assert total == money(float(price) * quantity)
+        # Float prices, as older callers and config values pass them
+        assert line_total(float(price), quantity) == total
+
+
+def test_empty_cart():
+    totals = CartTotals([], Decimal('2.99'))
+    assert (totals.lines, totals.items, totals.subtotal, totals.total) == ({}, 0, ZERO, Decimal('2.99'))
+
+
+def test_float_drift_does_not_reach_totals():
+    # 0.1 + 0.2 == 0.30000000000000004 in floats
+    cart_items = [SimpleNamespace(id=1, quantity=1, menu_item=SimpleNamespace(price=Decimal('0.10'))),
+                  SimpleNamespace(id=2, quantity=1, menu_item=SimpleNamespace(price=Decimal('0.20')))]
+    assert float_subtotal(cart_items) != 0.3
+    assert CartTotals(cart_items).subtotal == Decimal('0.30')
+
+
+@pytest.mark.parametrize('value, expected', [
+    (Decimal('0.005'), Decimal('0.01')),
+    (Decimal('0.0049999'), Decimal('0.00')),
+    (Decimal('2.675'), Decimal('2.68')),
+    (Decimal('2.665'), Decimal('2.67')),
+    (Decimal('-0.005'), Decimal('-0.01')),
+    (Decimal('-0.004'), Decimal('0.00')),
+    (Decimal('99999999.995'), Decimal('100000000.00')),
+    # Floats go through str(): 1.005 is 1.00499999999999989... in binary
+    (1.005, Decimal('1.01')),
+    (2.675, Decimal('2.68')),
+    (0.1, Decimal('0.10')),
+    (3, Decimal('3.00')),
+    ('4.5', Decimal('4.50')),
+])
+def test_money_rounds_half_up_to_cents(value, expected):
+    result = money(value)
+    assert result == expected
+    assert result.as_tuple().exponent == -2
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_money_is_idempotent_on_cents(seed):
+    rng = random.Random(seed)
+    for _ in range(CARTS_PER_SEED):
+        value = Decimal(rng.randint(-10 ** 8, 10 ** 8)) / 100
+        assert money(value) == value
+        assert money(money(value)) == money(value)
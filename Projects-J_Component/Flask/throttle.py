@@ -0,0 +1,41 @@
+from cache import cache
+
+
+class LoginThrottle:
+    """Counts failed logins per client IP and per username in fixed windows
+
+    Checked before any password hashing, so a blocked client costs two
+    cache reads. Counters live in Redis, or per worker if Redis is down.
+    """
+
+    def __init__(self, app=None):
+        self.window = 300
+        self.max_per_ip = 20
+        self.max_per_user = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.window = app.config.get('LOGIN_THROTTLE_WINDOW', self.window)
+        self.max_per_ip = app.config.get('LOGIN_MAX_FAILURES_PER_IP', self.max_per_ip)
+        self.max_per_user = app.config.get('LOGIN_MAX_FAILURES_PER_USER', self.max_per_user)
+
+    def _keys(self, ip, username):
+        return (cache.key('login-failures', 'ip', ip),
+                cache.key('login-failures', 'user', username.lower()))
+
+    def is_blocked(self, ip, username):
+        ip_count, user_count = (int(value or 0) for value in cache.get_many(self._keys(ip, username)))
+        return ip_count >= self.max_per_ip or user_count >= self.max_per_user
+
+    def record_failure(self, ip, username):
+        for key in self._keys(ip, username):
+            cache.incr(key, self.window)
+
+    def reset(self, ip, username):
+        # Only the username counter: one valid account must not let a client
+        # clear its IP counter between guesses against other accounts
+        cache.delete(self._keys(ip, username)[1])
+
+
+login_throttle = LoginThrottle()